@@ -0,0 +1,122 @@
+# ETL Benchmarks: Lease Store Checks
+# R. Wagner, 2023
+#
+# Behavioral checks of the coordination tables used by tealiumETL.run_sharded(): claims, lease expiry and takeover,
+# watermark fencing and the failure store. redshiftLeaseStore's SQL is executed by fakes.sqliteDataAPI. Example:
+#   python etl/benchmarks/check_lease_stores.py
+# Lease expiry is checked with whole-second timestamps, so a run takes several seconds.
+
+import os
+import sys
+import time
+import threading
+import tempfile
+from datetime import datetime, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ETL_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path[:0] = [BENCHMARK_DIR, ETL_DIR]
+
+import fakes
+
+failures = []
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    if not condition:
+        failures.append(message)
+
+def check_lease_store(name, make_store):
+    store = make_store('basic')
+    store.ensure_shards(4, initial_watermark='events/0')
+    store.ensure_shards(4, initial_watermark='events/0')
+    check(store.shard_count() == 4, f'{name}: ensure_shards() is safe to re-run')
+    try:
+        store.ensure_shards(3, initial_watermark='events/0')
+        check(False, f'{name}: ensure_shards() rejects a different number of shards')
+    except Exception:
+        check(True, f'{name}: ensure_shards() rejects a different number of shards')
+
+    claimed = [store.claim(f'worker-{n}', lease_seconds=60) for n in range(5)]
+    check(sorted(claimed[:4]) == [0, 1, 2, 3] and claimed[4] is None, f'{name}: each shard is claimed by one worker only')
+    holder = claimed.index(2)
+    check(store.set_watermark(2, f'worker-{holder}', 'events/5', lease_seconds=60), f'{name}: the holder can advance the watermark')
+    check(not store.set_watermark(2, 'worker-9', 'events/6', lease_seconds=60), f'{name}: other workers cannot advance it')
+    check(store.get_watermark(2) == 'events/5', f'{name}: the watermark is kept')
+    store.release(2, f'worker-{holder}')
+    check(store.claim('worker-9', lease_seconds=60) == 2, f'{name}: a released shard can be claimed again')
+    check(store.claim('worker-9', lease_seconds=60, exclude={0, 1, 3}) is None, f'{name}: exclude is honored')
+
+    # a lease that runs out is taken over, and the old holder is fenced off even when it writes the same watermark
+    store = make_store('expiry')
+    store.ensure_shards(1, initial_watermark='events/0')
+    check(store.claim('worker-a', lease_seconds=1) == 0, f'{name}: worker-a claims the only shard')
+    check(store.claim('worker-b', lease_seconds=60) is None, f'{name}: a live lease cannot be claimed')
+    time.sleep(2.1)
+    check(store.claim('worker-b', lease_seconds=60) == 0, f'{name}: an expired lease is taken over')
+    check(store.set_watermark(0, 'worker-b', 'events/1', lease_seconds=60), f'{name}: the new holder advances the watermark')
+    check(not store.set_watermark(0, 'worker-a', 'events/1', lease_seconds=60), f'{name}: the old holder is fenced off, even for the same watermark')
+
+    # shards drained by other workers during this run are not claimed again
+    store = make_store('released')
+    store.ensure_shards(2, initial_watermark='events/0')
+    time.sleep(1.1)
+    started = datetime.now(timezone.utc)
+    time.sleep(1.1)
+    drained = store.claim('worker-a', lease_seconds=60, released_before=started)
+    store.release(drained, 'worker-a')
+    other = store.claim('worker-b', lease_seconds=60, released_before=started)
+    check(other is not None and other != drained, f'{name}: shards untouched since the run started can be claimed')
+    check(store.claim('worker-c', lease_seconds=60, released_before=started) is None, f'{name}: shards released during the run cannot')
+
+    # concurrent claims: every shard goes to exactly one worker
+    store = make_store('concurrent')
+    store.ensure_shards(4, initial_watermark='events/0')
+    claims = []
+    def claim(n):
+        claims.append(store.claim(f'worker-{n}', lease_seconds=60))
+    workers = [threading.Thread(target=claim, args=(n,)) for n in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    won = [shard_id for shard_id in claims if shard_id is not None]
+    check(sorted(won) == [0, 1, 2, 3], f'{name}: concurrent claims give each shard to one worker ({sorted(won)})')
+
+def check_duplicate_shards(tealium_events, data_api):
+    # Redshift does not enforce primary keys; rows duplicated by concurrent setups are collapsed to the lowest watermark
+    store = tealium_events.redshiftLeaseStore('leases_duplicates')
+    store.ensure_shards(2, initial_watermark='events/5')
+    data_api.execute_statement(query="insert into leases_duplicates.shard_leases values (1, 2, null, null, 'events/3', getdate())")
+    store.ensure_shards(2, initial_watermark='events/5')
+    check(store.shard_count() == 2 and store.get_watermark(1) == 'events/3', 'redshiftLeaseStore: duplicate shard rows are collapsed')
+
+def check_failure_store(name, store):
+    store.ensure()
+    store.ensure()
+    store.record('events/1.gz', datetime(2022, 1, 1, tzinfo=timezone.utc), 'pending', 1)
+    store.record('events/1.gz', datetime(2022, 1, 1, tzinfo=timezone.utc), 'skipped', 3)
+    store.record('events/2.gz', datetime(2022, 1, 2, tzinfo=timezone.utc), 'no_hour', 0)
+    listed = store.list()
+    check([(key, status) for key, _, status in listed] == [('events/1.gz', 'skipped'), ('events/2.gz', 'no_hour')],
+          f'{name}: recording an object again replaces its row')
+    check(listed[0][1] == datetime(2022, 1, 1, tzinfo=timezone.utc), f'{name}: last modified round-trips')
+    store.clear('events/1.gz')
+    check([key for key, _, _ in store.list()] == ['events/2.gz'], f'{name}: clear() removes the object')
+
+def main():
+    tables = [f'leases_{label}.shard_leases' for label in ['basic', 'expiry', 'released', 'concurrent', 'duplicates']] + ['tealium.failed_objects']
+    env = fakes.localEnvironment(data_api=fakes.sqliteDataAPI(tables=tables))
+    with env.active(), tempfile.TemporaryDirectory() as tmp:
+        tealium_events = env.import_module('tealium_events')
+        check_lease_store('sqliteLeaseStore', lambda label: tealium_events.sqliteLeaseStore(os.path.join(tmp, f'{label}.db')))
+        check_lease_store('redshiftLeaseStore', lambda label: tealium_events.redshiftLeaseStore(f'leases_{label}'))
+        check_duplicate_shards(tealium_events, env.data_api)
+        check_failure_store('sqliteFailureStore', tealium_events.sqliteFailureStore(os.path.join(tmp, 'failures.db')))
+        check_failure_store('redshiftFailureStore', tealium_events.redshiftFailureStore('tealium'))
+
+    print(f'{len(failures)} check(s) failed.' if failures else 'All checks passed.')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+# ETL Benchmarks: Local Stand-ins
+# R. Wagner, 2023
+
+import sys
+import io
+import json
+import time
+import types
+import uuid
+import re
+import sqlite3
+import threading
+import contextlib
+import importlib
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+import boto3
+import requests
+
+class fakeS3:
+    '''
+    In-process stand-in for S3. Implements the subset of the boto3 client (list_objects_v2) and
+    resource (Bucket().download_file(), Object().put()/get()) interfaces used by the ETL modules.
+    Objects are held in memory as bytes; an optional per-call latency simulates network round trips.
+    '''
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.buckets = {} # bucket name > {key: (body, last_modified)}
+        self.calls = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lock = threading.Lock()
+
+    def record_call(self, operation):
+        self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put_bytes(self, bucket, key, body, last_modified=None):
+        if isinstance(body, str):
+            body = body.encode('utf8')
+        with self.lock:
+            self.buckets.setdefault(bucket, {})[key] = (body, last_modified or datetime.now(timezone.utc))
+        self.bytes_in += len(body)
+
+    def get_bytes(self, bucket, key):
+        try:
+            body = self.buckets[bucket][key][0]
+        except KeyError:
+            raise KeyError(f'NoSuchKey: s3://{bucket}/{key}') from None
+        self.bytes_out += len(body)
+        return body
+
+    def keys(self, bucket, prefix=''):
+        return sorted(key for key in self.buckets.get(bucket, {}) if key.startswith(prefix))
+
+    # client interface
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', MaxKeys=1000, ContinuationToken=None):
+        self.record_call('list_objects_v2')
+        start_after = max(StartAfter or '', ContinuationToken or '')
+        keys = [key for key in self.keys(Bucket, Prefix) if key > start_after]
+        page = keys[:MaxKeys]
+        response = {'Name': Bucket, 'Prefix': Prefix, 'KeyCount': len(page), 'MaxKeys': MaxKeys, 'IsTruncated': len(keys) > MaxKeys}
+        if page: # like S3, 'Contents' is omitted entirely when nothing matches
+            response['Contents'] = [{'Key': key,
+                                     'LastModified': self.buckets[Bucket][key][1],
+                                     'Size': len(self.buckets[Bucket][key][0])} for key in page]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    # resource interface
+    def Bucket(self, name):
+        return fakeS3Bucket(self, name)
+
+    def Object(self, bucket_name, key):
+        return fakeS3Object(self, bucket_name, key)
+
+class fakeS3Bucket:
+    def __init__(self, s3, name):
+        self.s3 = s3
+        self.name = name
+
+    def download_file(self, Key, Filename):
+        self.s3.record_call('download_file')
+        with open(Filename, 'wb') as f:
+            f.write(self.s3.get_bytes(self.name, Key))
+
+    def upload_file(self, Filename, Key):
+        self.s3.record_call('upload_file')
+        with open(Filename, 'rb') as f:
+            self.s3.put_bytes(self.name, Key, f.read())
+
+class fakeS3Object:
+    def __init__(self, s3, bucket_name, key):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.key = key
+
+    def put(self, Body):
+        self.s3.record_call('put_object')
+        self.s3.put_bytes(self.bucket_name, self.key, Body)
+        return {'ETag': uuid.uuid4().hex}
+
+    def get(self):
+        self.s3.record_call('get_object')
+        return {'Body': io.BytesIO(self.s3.get_bytes(self.bucket_name, self.key))}
+
+class fakeDataAPI:
+    '''
+    Stand-in for the Redshift Data API as wrapped by db3. Statements are not executed; each one is recorded
+    along with its wall time, and validate_query() sleeps for the configured latency to simulate polling
+    until the statement finishes. Results for SELECT statements are supplied by responders registered with
+    add_result(), matched against the statement text in the order they were added.
+    '''
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.statements = {} # statement ID > {'query', 'submitted', 'finished'}
+        self.responders = []
+        self.lock = threading.Lock()
+
+    def add_result(self, pattern, records):
+        '''
+        Registers the records (or a callable taking the query text and returning records) returned by
+        get_statement_result() for any statement matching the regex pattern.
+        '''
+        self.responders.append((re.compile(pattern, re.IGNORECASE | re.DOTALL), records))
+
+    def execute_statement(self, query):
+        statement_id = str(uuid.uuid4())
+        with self.lock:
+            self.statements[statement_id] = {'query': ' '.join(query.split()), 'submitted': time.perf_counter(), 'finished': None}
+        return {'Id': statement_id}
+
+    def validate_query(self, response_id):
+        if self.latency:
+            time.sleep(self.latency)
+        self.statements[response_id]['finished'] = time.perf_counter()
+
+    def get_statement_result(self, response):
+        query = self.statements[response['Id']]['query']
+        for pattern, records in self.responders:
+            if pattern.search(query):
+                return {'Records': records(query) if callable(records) else records, 'TotalNumRows': 0}
+        return {'Records': [], 'TotalNumRows': 0}
+
+    def queries(self, pattern=None):
+        return [s['query'] for s in self.statements.values() if pattern is None or re.search(pattern, s['query'], re.IGNORECASE)]
+
+class sqliteDataAPI(fakeDataAPI):
+    '''
+    fakeDataAPI that also executes statements touching the given tables (named 'schema.table') in an in-memory
+    SQLite database, so that code whose behavior lives in its SQL, such as tealium_events.redshiftLeaseStore, can be
+    checked rather than only timed. Redshift's getdate() and dateadd(second, n, getdate()) are translated; both have
+    whole-second precision. Statements run one at a time, so concurrent callers interleave between statements.
+    Any other statement is only recorded, as by fakeDataAPI.
+    '''
+    def __init__(self, tables, latency=0.0):
+        super().__init__(latency=latency)
+        self.tables = [table.lower() for table in tables]
+        self.connection = sqlite3.connect(':memory:', isolation_level=None, check_same_thread=False)
+        for schema in sorted({table.split('.')[0] for table in self.tables}):
+            self.connection.execute(f"attach database ':memory:' as {schema}")
+        self.results = {} # statement ID > rows, or the exception raised by SQLite
+        self.sql_lock = threading.Lock()
+
+    @staticmethod
+    def translate(query):
+        query = re.sub(r'dateadd\(second,\s*(-?\d+),\s*getdate\(\)\)', lambda m: f"datetime('now', '{int(m.group(1)):+d} seconds')", query, flags=re.IGNORECASE)
+        return re.sub(r'getdate\(\)', "datetime('now')", query, flags=re.IGNORECASE)
+
+    def execute_statement(self, query):
+        response = super().execute_statement(query)
+        if any(table in query.lower() for table in self.tables):
+            try:
+                with self.sql_lock:
+                    if re.search(r'begin transaction', query, re.IGNORECASE):
+                        self.connection.executescript(self.translate(query))
+                        rows = []
+                    else:
+                        rows = self.connection.execute(self.translate(query)).fetchall()
+                self.results[response['Id']] = rows
+            except sqlite3.Error as e:
+                if self.connection.in_transaction:
+                    self.connection.execute('rollback')
+                self.results[response['Id']] = e
+        return response
+
+    def validate_query(self, response_id):
+        super().validate_query(response_id)
+        if isinstance(self.results.get(response_id), Exception): # a FAILED statement, as reported by describe_statement
+            raise Exception(f'[ERROR] Statement {response_id} failed: {self.results[response_id]}')
+
+    def get_statement_result(self, response):
+        if response['Id'] not in self.results:
+            return super().get_statement_result(response)
+        records = [[{'isNull': True} if value is None
+                    else {'longValue': value} if isinstance(value, int)
+                    else {'doubleValue': value} if isinstance(value, float)
+                    else {'stringValue': value} for value in row] for row in self.results[response['Id']]]
+        return {'Records': records, 'TotalNumRows': len(records)}
+
+def fake_db3(s3, data_api, verbose=False):
+    '''
+    Builds a module object exposing the db3 functions used by the ETL modules, backed by a fakeS3 and fakeDataAPI.
+    Log records are kept on the module ('records') so that errors swallowed by the ETL code can still be counted.
+    '''
+    db3 = types.ModuleType('db3')
+    db3.records = []
+    db3.s3_resource = s3
+    db3.s3_client = s3
+
+    def log(type='info', message='', do_raise=False, e=None):
+        db3.records.append({'type': type, 'message': message, 'e': e, 'time': time.perf_counter()})
+        if verbose or type == 'error':
+            print(f'[{type.upper()}] {message}' + (f' ({e})' if e else ''), file=sys.stderr)
+        if do_raise:
+            raise Exception(f'[ERROR] {message}') from e
+
+    def write_s3(df, bucket_name, prefix, filename):
+        s3.Object(bucket_name, f'{prefix}{filename}.csv').put(Body=df.to_csv(index=False, header=True))
+
+    db3.log = log
+    db3.write_s3 = write_s3
+    db3.execute_statement = data_api.execute_statement
+    db3.validate_query = data_api.validate_query
+    db3.get_statement_result = data_api.get_statement_result
+    return db3
+
+class stubHTTPServer:
+    '''
+    Local HTTP server run on a background thread. Subclasses implement handle(method, path, query, body),
+    returning (status code, response body). Requests and payload sizes are counted for reporting.
+    '''
+    def __init__(self):
+        self.requests = Counter()
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                split = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with stub.lock:
+                    stub.requests[f'{method} {split.path}'] += 1
+                    stub.bytes_received += len(body)
+                status, payload = stub.handle(method, split.path, split.query, body)
+                payload = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, format, *args): # silence per-request logging
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def handle(self, method, path, query, body):
+        return 404, {'status': {'user_message': f'No route for {method} {path}'}}
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class dbtCloudStub(stubHTTPServer):
+    '''
+    Serves the dbt Cloud "Runs" endpoint and the Metadata API's GraphQL endpoint from pre-generated run, model and test records.
+    '''
+    def __init__(self, runs, models, tests, latency=0.0):
+        super().__init__()
+        self.runs = runs
+        self.models = models
+        self.tests = tests
+        self.latency = latency
+
+    def handle(self, method, path, query, body):
+        if self.latency:
+            time.sleep(self.latency)
+        run_match = re.match(r'^/api/v2/accounts/\d+/runs/?(\d+)?/?$', path)
+        if method == 'GET' and run_match:
+            if run_match.group(1):
+                run = next((r for r in self.runs if r['id'] == int(run_match.group(1))), None)
+                if run is None:
+                    return 404, {'status': {'user_message': 'Run not found.'}}
+                return 200, {'status': {'code': 200}, 'data': run}
+            params = dict(p.split('=', 1) for p in query.split('&') if '=' in p)
+            runs = self.runs
+            if 'job_definition_id' in params:
+                runs = [r for r in runs if r['job_definition_id'] == int(params['job_definition_id'])]
+            runs = sorted(runs, key=lambda r: r['created_at'], reverse=True)[:int(params.get('limit') or len(runs))]
+            return 200, {'status': {'code': 200}, 'data': runs}
+        if method == 'POST' and path.rstrip('/') == '/graphql':
+            graphql = json.loads(body)['query']
+            ids = dict(re.findall(r'(jobId|runId):\s*(\d+)', graphql)) # echo the requested run, as the real API would
+            ids = {key: int(value) for key, value in ids.items()}
+            if re.search(r'^\W*models\(', graphql):
+                return 200, {'data': {'models': [dict(model, **ids) for model in self.models]}}
+            if re.search(r'^\W*tests\(', graphql):
+                return 200, {'data': {'tests': [dict(test, **ids) for test in self.tests]}}
+            return 400, {'errors': [{'message': 'Unsupported query.'}]}
+        return super().handle(method, path, query, body)
+
+class mixpanelStub(stubHTTPServer):
+    '''
+    Accepts Mixpanel profile batch updates. Optionally answers every Nth request with a 429 to exercise retry logic.
+    '''
+    def __init__(self, rate_limit_every=None, latency=0.0):
+        super().__init__()
+        self.rate_limit_every = rate_limit_every
+        self.latency = latency
+        self.profiles = 0
+        self.posts = 0
+
+    def handle(self, method, path, query, body):
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'POST' and path.rstrip('/') == '/engage':
+            with self.lock:
+                self.posts += 1
+                if self.rate_limit_every and self.posts % self.rate_limit_every == 0:
+                    return 429, {'error': 'rate limit exceeded', 'status': 0}
+                self.profiles += len(json.loads(body))
+            return 200, {'error': None, 'status': 1}
+        return super().handle(method, path, query, body)
+
+class localEnvironment:
+    '''
+    Bundles the local stand-ins and swaps them in for db3, boto3 and the requests module while active.
+    HTTP calls to hosts in 'routes' (host > stub server) are rewritten to the matching local stub; calls to any
+    other host are refused so that a benchmark can never reach a live service.
+    '''
+    def __init__(self, s3=None, data_api=None, routes=None, verbose=False):
+        self.s3 = s3 or fakeS3()
+        self.data_api = data_api or fakeDataAPI()
+        self.routes = routes or {}
+        self.db3 = fake_db3(self.s3, self.data_api, verbose=verbose)
+
+    def __rewrite(self, url):
+        split = urlsplit(url)
+        if split.hostname not in self.routes:
+            raise ConnectionError(f'Blocked call to {split.hostname}: no local stub registered.')
+        local = urlsplit(self.routes[split.hostname].base_url)
+        return urlunsplit((local.scheme, local.netloc, split.path, split.query, ''))
+
+    def errors(self):
+        return [r for r in self.db3.records if r['type'] == 'error']
+
+    def import_module(self, name):
+        '''
+        Imports an ETL module (call from within active()) and binds its 'db3' name to this environment's stand-in,
+        since a module imported by an earlier environment still holds that environment's db3.
+        '''
+        module = importlib.import_module(name)
+        module.db3 = self.db3
+        return module
+
+    @contextlib.contextmanager
+    def active(self):
+        '''
+        Installs the stand-ins for the duration of the block and restores the originals afterwards.
+        '''
+        saved_db3 = sys.modules.get('db3')
+        saved_attrs = [(boto3, 'client', boto3.client), (boto3, 'resource', boto3.resource),
+                       (requests, 'get', requests.get), (requests, 'post', requests.post)]
+        get, post = requests.get, requests.post
+
+        sys.modules['db3'] = self.db3
+        boto3.client = lambda *args, **kwargs: self.s3
+        boto3.resource = lambda *args, **kwargs: self.s3
+        requests.get = lambda url, **kwargs: get(self.__rewrite(url), **kwargs)
+        requests.post = lambda url, **kwargs: post(self.__rewrite(url), **kwargs)
+        try:
+            yield self
+        finally:
+            for obj, attr, value in saved_attrs:
+                setattr(obj, attr, value)
+            if saved_db3 is None:
+                sys.modules.pop('db3', None)
+            else:
+                sys.modules['db3'] = saved_db3
@@ -0,0 +1,199 @@
+# ETL Benchmarks: Synthetic Data
+# R. Wagner, 2023
+
+import gzip
+import json
+import random
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+EVENT_NAMES = ['page_view', 'product_view', 'add_to_cart', 'checkout_start', 'purchase', 'sign_up', 'login', 'search']
+DOMAINS = ['www.example.com', 'shop.example.com', 'help.example.com']
+REFERRERS = ['https://www.google.com/', 'https://www.facebook.com/', 'https://t.co/', '', '']
+PERSONAS = ['Bargain Hunter', 'Loyalist', 'Researcher', 'Impulse Buyer', 'Unknown']
+
+def tealium_feed_file(n_events, start_time, window=timedelta(minutes=5), rng=None):
+    '''
+    Returns a gzipped Tealium event feed file: one JSON event per line, with 'eventtime' stored as epoch milliseconds.
+
+    Parameters:
+        n_events (int):
+            The number of events in the file.
+        start_time (datetime):
+            Timestamp of the earliest event; events are spread uniformly across 'window' after it.
+        rng (random.Random, optional):
+            Source of randomness, for reproducible files.
+    '''
+    rng = rng or random.Random()
+    start_ms = int(start_time.timestamp() * 1000)
+    window_ms = int(window.total_seconds() * 1000)
+    lines = []
+    for _ in range(n_events):
+        domain = rng.choice(DOMAINS)
+        path = f'/{rng.choice(["products", "cart", "account", "search"])}/{rng.randint(1, 5000)}'
+        event = {'eventid': '%032x' % rng.getrandbits(128),
+                 'eventtime': start_ms + rng.randint(0, window_ms),
+                 'visitorid': '%016x' % rng.getrandbits(64),
+                 'account': 'example',
+                 'profile': 'main',
+                 'event_name': rng.choice(EVENT_NAMES),
+                 'pageurl_domain': domain,
+                 'pageurl_path': path,
+                 'pageurl_full_url': f'https://{domain}{path}',
+                 'referrer': rng.choice(REFERRERS),
+                 'useragent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.1 Safari/605.1.15',
+                 'udo': {'tealium_session_id': str(rng.getrandbits(40)),
+                         'cart_value': round(rng.uniform(0, 500), 2),
+                         'customer_id': rng.randint(1, 100000) if rng.random() < 0.4 else None}}
+        lines.append(json.dumps(event))
+    # no trailing newline: the extract step splits on '\n' and parses every element
+    return gzip.compress('\n'.join(lines).encode('utf8'))
+
+def tealium_object_key(prefix, file_time, index):
+    # keys sort in creation order, which the 'StartAfter' watermark relies on
+    return f"{prefix}{file_time.strftime('%Y%m%d%H%M%S')}_{index:06d}.gz"
+
+def seed_tealium_feed(s3, bucket, prefix, n_objects, events_per_object, start=datetime(2022, 1, 1, tzinfo=timezone.utc),
+                      interval=timedelta(minutes=5), first_index=0, seed=0):
+    '''
+    Writes n_objects feed files into the fake S3 bucket, one every 'interval' from 'start'. Returns the list of object keys.
+    '''
+    rng = random.Random(seed)
+    keys = []
+    for i in range(first_index, first_index + n_objects):
+        file_time = start + i * interval
+        key = tealium_object_key(prefix, file_time, i)
+        s3.put_bytes(bucket, key, tealium_feed_file(events_per_object, file_time, window=interval, rng=rng), last_modified=file_time + interval)
+        keys.append(key)
+    return keys
+
+def user_snapshot(n_users, seed=0):
+    '''
+    Returns a data frame shaped like the Mixpanel user properties model, including the MD5 'key' over all property values.
+    '''
+    rng = random.Random(seed)
+    created = datetime(2020, 1, 1)
+    rows = []
+    for user_id in range(1, n_users + 1):
+        n_purchases = rng.choice([0, 0, 1, 2, 3, 5, 8])
+        revenue = round(n_purchases * rng.uniform(20, 150), 2)
+        rows.append({'user_id': user_id,
+                     'name': f'User {user_id}',
+                     'email': f'user{user_id}@example.com',
+                     'created_at_utc': (created + timedelta(minutes=rng.randint(0, 1000000))).strftime('%Y-%m-%d %H:%M:%S'),
+                     'is_customer': 't' if n_purchases else 'f',
+                     'n_purchases': n_purchases,
+                     'last_purchase_utc': (created + timedelta(days=rng.randint(300, 1000))).strftime('%Y-%m-%d %H:%M:%S') if n_purchases else None,
+                     'total_revenue': revenue,
+                     'clv': round(revenue * rng.uniform(1, 3), 2),
+                     'cac': round(rng.uniform(5, 60), 2),
+                     'persona': rng.choice(PERSONAS),
+                     'updated_at_utc': '2022-12-31 00:00:00'})
+    df = pd.DataFrame(rows)
+    return with_md5_key(df)
+
+def with_md5_key(df):
+    values = df.drop(columns=['key'], errors='ignore').astype(str).agg('|'.join, axis=1)
+    df['key'] = values.map(lambda x: hashlib.md5(x.encode('utf8')).hexdigest())
+    return df
+
+def seed_user_snapshots(s3, bucket, prefix, identifier, n_users, change_fraction=0.05, new_fraction=0.01, seed=0):
+    '''
+    Writes a reference file and a newer snapshot file, as read by the Mixpanel user properties job. The snapshot adds
+    new_fraction * n_users users and changes properties for change_fraction * n_users existing ones.
+    Returns the number of profiles the job is expected to upsert.
+    '''
+    rng = random.Random(seed)
+    reference = user_snapshot(n_users, seed=seed)
+    n_new = max(int(n_users * new_fraction), 0)
+    snapshot = user_snapshot(n_users + n_new, seed=seed)
+    changed = rng.sample(range(n_users), max(int(n_users * change_fraction), 1))
+    snapshot.loc[changed, 'persona'] = snapshot.loc[changed, 'persona'].map(lambda p: PERSONAS[(PERSONAS.index(p) + 1) % len(PERSONAS)])
+    snapshot.loc[changed, 'updated_at_utc'] = '2023-01-01 00:00:00'
+    snapshot = with_md5_key(snapshot)
+
+    for df, suffix in [(reference, '_reference.gz'), (snapshot, '_snapshot000.gz')]:
+        s3.put_bytes(bucket, f'{prefix}{identifier}{suffix}', gzip.compress(df.to_csv(sep='|', index=False).encode('utf8')))
+    return len(changed) + n_new
+
+def dbt_runs(n_runs, account_id, job_ids, start=datetime(2022, 12, 1, tzinfo=timezone.utc), seed=0):
+    '''
+    Returns run records shaped like the dbt Cloud "Runs" endpoint (with trigger included), newest first.
+    Roughly one in five runs is manual; the rest are scheduled.
+    '''
+    rng = random.Random(seed)
+    runs = []
+    for i in range(n_runs):
+        created = start + timedelta(hours=i)
+        started = created + timedelta(seconds=rng.randint(5, 60))
+        job_id = job_ids[i % len(job_ids)]
+        run_id = 100000 + i
+        cause = 'Kicked off from UI by analyst@example.com' if rng.random() < 0.2 else 'Scheduled from dbt Cloud'
+        runs.append({'id': run_id,
+                     'account_id': account_id,
+                     'job_definition_id': job_id,
+                     'status': 10,
+                     'status_humanized': 'Success',
+                     'created_at': created.isoformat(),
+                     'should_start_at': created.isoformat(),
+                     'started_at': started.isoformat(),
+                     'finished_at': (started + timedelta(minutes=rng.randint(5, 40))).isoformat(),
+                     'href': f'https://cloud.getdbt.com/#/accounts/{account_id}/projects/1/runs/{run_id}/',
+                     'trigger': {'id': run_id, 'cause': cause}})
+    return runs[::-1]
+
+def dbt_models(n_models, run_id, job_id, seed=0):
+    '''
+    Returns model records shaped like the Metadata API's 'models' query for a single run.
+    '''
+    rng = random.Random(seed)
+    started = datetime(2022, 12, 1, tzinfo=timezone.utc)
+    models = []
+    for i in range(n_models):
+        compile_start = started + timedelta(seconds=rng.randint(0, 600))
+        execute_start = compile_start + timedelta(seconds=rng.randint(1, 5))
+        execution_time = round(rng.uniform(0.5, 120), 3)
+        status = 'error' if rng.random() < 0.02 else 'success'
+        models.append({'runId': run_id,
+                       'jobId': job_id,
+                       'uniqueId': f'model.example.model_{i}',
+                       'name': f'model_{i}',
+                       'description': f'Model number {i}.',
+                       'schema': rng.choice(['staging', 'intermediate', 'marts']),
+                       'error': 'Database Error' if status == 'error' else None,
+                       'status': status,
+                       'skip': False,
+                       'compileStartedAt': compile_start.isoformat(),
+                       'compileCompletedAt': execute_start.isoformat(),
+                       'executeStartedAt': execute_start.isoformat(),
+                       'executeCompletedAt': (execute_start + timedelta(seconds=execution_time)).isoformat(),
+                       'executionTime': execution_time,
+                       'runGeneratedAt': started.isoformat(),
+                       'runElapsedTime': 900.0})
+    return models
+
+def dbt_tests(n_tests, run_id, job_id, seed=0):
+    '''
+    Returns test records shaped like the Metadata API's 'tests' query, mixing generic and custom tests.
+    '''
+    rng = random.Random(seed)
+    tests = []
+    for i in range(n_tests):
+        column = rng.choice(['id', 'user_id', 'created_at', 'status'])
+        test_type = rng.choice(['unique_', 'not_null_', 'accepted_values_', 'relationships_', ''])
+        name = f'{test_type}model_{i}_{column}' + (f'__{"%08x" % rng.getrandbits(32)}' if test_type == 'accepted_values_' else '')
+        status = 'fail' if rng.random() < 0.03 else 'pass'
+        tests.append({'runId': run_id,
+                      'jobId': job_id,
+                      'name': name if test_type else f'assert_model_{i}_is_valid',
+                      'description': None,
+                      'state': status,
+                      'columnName': column if test_type else None,
+                      'status': status,
+                      'error': None,
+                      'fail': status == 'fail',
+                      'warn': False,
+                      'skip': False})
+    return tests
@@ -0,0 +1,447 @@
+# ETL Benchmarks
+# R. Wagner, 2023
+#
+# Runs each ETL module end-to-end against local stand-ins (see fakes.py) and reports wall time, throughput
+# and peak Python memory for every pipeline stage. Example:
+#   python etl/benchmarks/run_benchmarks.py --scale medium --output results.json --baseline previous.json
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+import runpy
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import tracemalloc
+from datetime import datetime, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ETL_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path[:0] = [BENCHMARK_DIR, ETL_DIR]
+
+import fakes
+import generators
+
+# objects/events for Tealium, users for Mixpanel, runs/models/tests for dbt
+SCALES = {'small':  {'objects': 10,  'events_per_object': 200,  'users': 2000,   'runs': 20,  'models': 100,  'tests': 300},
+          'medium': {'objects': 100, 'events_per_object': 1000, 'users': 20000,  'runs': 50,  'models': 500,  'tests': 2000},
+          'large':  {'objects': 500, 'events_per_object': 5000, 'users': 100000, 'runs': 100, 'models': 2000, 'tests': 10000}}
+
+TEALIUM_CONFIG = {'tealium_aws_region': 'us-east-1',
+                  'tealium_access_key_id': 'local',
+                  'tealium_secret_access_key': 'local',
+                  'tealium_bucket_name': 'tealium-feed',
+                  'tealium_prefix': 'example/main/events/',
+                  'bucket_name': 'glue-assets',
+                  'bucket_prefix': 'tealium/',
+                  'iam_role': 'aws_iam_role=arn:aws:iam::0123456789:role/RedshiftS3',
+                  'target_schema': 'tealium',
+                  'target_table': 'events',
+                  'object_list_schema': 'tealium',
+                  'object_list_table': 'loaded_objects',
+                  'keep_cols': ['eventid', 'eventtime', 'visitorid', 'event_name', 'pageurl_domain', 'pageurl_path', 'referrer'],
+                  'rename_dict': {'eventid': 'event_id', 'eventtime': 'event_time', 'visitorid': 'visitor_id',
+                                  'pageurl_domain': 'page_domain', 'pageurl_path': 'page_path'}}
+
+DBT_CONFIG = {'dbt_account_id': 12345,
+              'dbt_api_key': 'local',
+              'dbt_production_job_id': 111,
+              'dbt_test_job_id': 222,
+              'bucket_name': 'glue-assets',
+              'bucket_prefix': 'dbt/',
+              'target_schema': 'dbt_audits',
+              'iam_role': 'aws_iam_role=arn:aws:iam::0123456789:role/RedshiftS3'}
+
+# get_last_object(), but not the failure store's listing of the same column
+LAST_OBJECT_QUERY = r'select object_key from \w+\.loaded_objects where'
+
+# fixed by the config dictionary at the top of mixpanel_user_properties.py
+MIXPANEL_S3 = {'bucket': 'glue-assets', 'prefix': 'mixpanel/', 'identifier': 'mixpanel_user_properties'}
+
+class stageRecorder:
+    '''
+    Times the stages of one pipeline run. Each stage records wall time, peak traced memory and the number of
+    Data API statements, S3 calls, HTTP requests and logged errors it produced.
+    '''
+    def __init__(self, pipeline, env, stubs=(), track_memory=True):
+        self.pipeline = pipeline
+        self.env = env
+        self.stubs = stubs
+        self.track_memory = track_memory
+        self.results = []
+        self.failed = False
+
+    def __counters(self):
+        return {'statements': len(self.env.data_api.statements),
+                's3_calls': sum(self.env.s3.calls.values()),
+                'http_requests': sum(sum(stub.requests.values()) for stub in self.stubs),
+                'errors': len(self.env.errors())}
+
+    def stage(self, name, fn, items=0, unit='rows'):
+        '''
+        Calls fn() as the named stage and returns its result. Once a stage raises, later stages are recorded as skipped,
+        since each one depends on the output of the last. 'items' may be a function of the result, for stages whose
+        output size is only known once they finish.
+        '''
+        count = items if callable(items) else None
+        result = {'pipeline': self.pipeline, 'stage': name, 'items': 0 if count else items, 'unit': unit, 'seconds': None, 'peak_mb': None, 'throughput': None}
+        self.results.append(result)
+        if self.failed:
+            result['skipped'] = True
+            return None
+
+        before = self.__counters()
+        if self.track_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        value = None
+        try:
+            value = fn()
+        except Exception as e:
+            self.failed = True
+            result['exception'] = str(e)
+            print(f'[ERROR] {self.pipeline}.{name}: {e}', file=sys.stderr)
+        result['seconds'] = time.perf_counter() - start
+        if self.track_memory:
+            result['peak_mb'] = (tracemalloc.get_traced_memory()[1] - baseline) / 2**20
+            tracemalloc.stop()
+        after = self.__counters()
+        result.update({key: after[key] - before[key] for key in after})
+        if count and value is not None:
+            result['items'] = count(value)
+        if result['items'] and result['seconds']:
+            result['throughput'] = result['items'] / result['seconds']
+        return value
+
+@contextlib.contextmanager
+def working_directory():
+    # the ETL modules write intermediate files to the current directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+def bench_tealium(scale, args):
+    env = fakes.localEnvironment(s3=fakes.fakeS3(latency=args.s3_latency),
+                                 data_api=fakes.fakeDataAPI(latency=args.data_api_latency),
+                                 verbose=args.verbose)
+    config = dict(TEALIUM_CONFIG)
+    generators.seed_tealium_feed(env.s3, config['tealium_bucket_name'], config['tealium_prefix'],
+                                 n_objects=scale['objects'], events_per_object=scale['events_per_object'], seed=args.seed)
+    # watermark sorts before every seeded key, so all objects are unloaded
+    env.data_api.add_result(LAST_OBJECT_QUERY, [[{'stringValue': config['tealium_prefix'] + '0'}]])
+
+    recorder = stageRecorder('tealium_events', env, track_memory=not args.skip_memory)
+    with env.active(), working_directory():
+        tealium_events = env.import_module('tealium_events')
+        etl = recorder.stage('init', lambda: tealium_events.tealiumETL(config), items=1, unit='clients')
+        last_object = recorder.stage('get_last_object', lambda: etl.get_last_object(), items=1, unit='queries')
+        object_list = recorder.stage('list_unloaded_objects', lambda: etl.list_unloaded_objects(last_object),
+                                     items=lambda objects: len(objects.index), unit='objects')
+        # one listing returns at most 1000 keys, so larger scales only process the first page
+        n_objects = len(object_list.index) if object_list is not None else 0
+        if n_objects < scale['objects']:
+            print(f"[WARN] tealium_events: listing returned {n_objects} of {scale['objects']} objects; later stages only process those", file=sys.stderr)
+        recorder.stage('extract_objects', lambda: etl.extract_objects(object_list), items=n_objects * scale['events_per_object'], unit='rows')
+        recorder.stage('load_objects', lambda: etl.load_objects(object_list), items=n_objects, unit='objects')
+    return recorder.results
+
+def bench_tealium_continuous(scale, args):
+    '''
+    Feeds objects into S3 one at a time (with a notification for each) while run_continuous() is ingesting, and reports
+    the latency from an object's arrival to its key being recorded in the object list table.
+    '''
+    env = fakes.localEnvironment(s3=fakes.fakeS3(latency=args.s3_latency),
+                                 data_api=fakes.fakeDataAPI(latency=args.data_api_latency),
+                                 verbose=args.verbose)
+    config = dict(TEALIUM_CONFIG)
+    env.data_api.add_result(LAST_OBJECT_QUERY, [[{'stringValue': config['tealium_prefix'] + '0'}]])
+    loaded_pattern = f"insert into {config['object_list_schema']}.{config['object_list_table']} values \\('([^']+)'"
+    arrivals = {}
+
+    recorder = stageRecorder('tealium_continuous', env, track_memory=not args.skip_memory)
+    with env.active(), working_directory():
+        tealium_events = env.import_module('tealium_events')
+        notifications = tealium_events.localNotificationQueue()
+        etl = tealium_events.tealiumETL(config)
+
+        def produce():
+            for i in range(scale['objects']):
+                key = generators.seed_tealium_feed(env.s3, config['tealium_bucket_name'], config['tealium_prefix'], n_objects=1,
+                                                   events_per_object=scale['events_per_object'], first_index=i, seed=args.seed + i)[0]
+                arrivals[key] = time.perf_counter()
+                notifications.notify(key)
+                time.sleep(args.arrival_interval)
+            # objects that are skipped or keep failing never show up as loaded, so give up a few flush intervals later
+            deadline = time.perf_counter() + args.flush_seconds * 3 + 10
+            while len(env.data_api.queries(loaded_pattern)) < scale['objects'] and not etl.stop_event.is_set():
+                if time.perf_counter() > deadline:
+                    print('[WARN] tealium_continuous: not every object was loaded by the deadline; stopping', file=sys.stderr)
+                    break
+                time.sleep(0.01)
+            etl.stop()
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        recorder.stage('run_continuous',
+                       lambda: etl.run_continuous(notifications=notifications, flush_rows=args.flush_rows, flush_seconds=args.flush_seconds,
+                                                  poll_seconds=min(args.flush_seconds, 1), list_interval_seconds=60),
+                       items=scale['objects'] * scale['events_per_object'], unit='rows')
+        etl.stop_event.set() # release the producer if ingestion failed
+        producer.join()
+
+    latencies = sorted(statement['finished'] - arrivals[match.group(1)]
+                       for statement in env.data_api.statements.values()
+                       for match in [re.search(loaded_pattern, statement['query'], re.IGNORECASE)] if match and match.group(1) in arrivals)
+    recorder.results[-1]['not_loaded'] = scale['objects'] - len(latencies)
+    if latencies:
+        recorder.results[-1].update({'latency_p50': statistics.median(latencies),
+                                     'latency_p95': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+                                     'latency_max': latencies[-1]})
+    return recorder.results
+
+def bench_tealium_sharded(scale, args):
+    '''
+    Loads the same feed with run_sharded() using one worker and then --workers worker threads sharing a lease store,
+    and checks that every object was loaded exactly once. With --lease-store redshift, the Redshift lease and failure
+    stores run their SQL against fakes.sqliteDataAPI. Workers share one process, so scaling is only close to linear
+    when time is dominated by simulated S3/Data API latency rather than by pandas under the GIL.
+    '''
+    config = dict(TEALIUM_CONFIG)
+    loaded_pattern = f"insert into {config['object_list_schema']}.{config['object_list_table']} values \\('([^']+)'"
+    results = []
+    for n_workers in sorted({1, args.workers}):
+        if args.lease_store == 'redshift':
+            tables = [f"{config['object_list_schema']}.shard_leases", f"{config['object_list_schema']}.{config['object_list_table']}_failed"]
+            data_api = fakes.sqliteDataAPI(tables=tables, latency=args.data_api_latency)
+        else:
+            data_api = fakes.fakeDataAPI(latency=args.data_api_latency)
+        env = fakes.localEnvironment(s3=fakes.fakeS3(latency=args.s3_latency), data_api=data_api, verbose=args.verbose)
+        keys = generators.seed_tealium_feed(env.s3, config['tealium_bucket_name'], config['tealium_prefix'],
+                                            n_objects=scale['objects'], events_per_object=scale['events_per_object'], seed=args.seed)
+        env.data_api.add_result(LAST_OBJECT_QUERY, [[{'stringValue': config['tealium_prefix'] + '0'}]])
+
+        recorder = stageRecorder('tealium_sharded', env, track_memory=not args.skip_memory)
+        with env.active(), working_directory() as tmp:
+            tealium_events = env.import_module('tealium_events')
+            if args.lease_store == 'redshift':
+                lease_store = tealium_events.redshiftLeaseStore(config['object_list_schema'])
+                failure_store = None # the default Redshift table
+            else:
+                lease_store = tealium_events.sqliteLeaseStore(os.path.join(tmp, 'leases.db'))
+                failure_store = tealium_events.sqliteFailureStore(os.path.join(tmp, 'leases.db'))
+            tealium_events.tealiumETL(config).setup_shards(lease_store, args.shards, failure_store=failure_store)
+            totals = []
+
+            def run_worker(n):
+                totals.append(tealium_events.tealiumETL(config).run_sharded(lease_store=lease_store, n_shards=args.shards, worker_id=f'worker-{n}',
+                                                                            strategy=args.shard_strategy, failure_store=failure_store))
+
+            def run_workers():
+                workers = [threading.Thread(target=run_worker, args=(n,)) for n in range(n_workers)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+
+            recorder.stage(f'workers={n_workers}', run_workers, items=scale['objects'] * scale['events_per_object'], unit='rows')
+
+        loaded = [re.search(loaded_pattern, query, re.IGNORECASE).group(1) for query in env.data_api.queries(loaded_pattern)]
+        recorder.results[-1].update({'lost': len(set(keys) - set(loaded)), 'duplicated': len(loaded) - len(set(loaded)),
+                                     'skipped': sum(len(t['skipped']) for t in totals),
+                                     'unfinished': sum(len(t['unfinished']) for t in totals)})
+        results += recorder.results
+    return results
+
+def bench_dbt(scale, args):
+    runs = generators.dbt_runs(scale['runs'], DBT_CONFIG['dbt_account_id'],
+                               [DBT_CONFIG['dbt_production_job_id'], DBT_CONFIG['dbt_test_job_id']], seed=args.seed)
+    stub = fakes.dbtCloudStub(runs=runs,
+                              models=generators.dbt_models(scale['models'], run_id=0, job_id=0, seed=args.seed),
+                              tests=generators.dbt_tests(scale['tests'], run_id=0, job_id=0, seed=args.seed),
+                              latency=args.http_latency).start()
+    env = fakes.localEnvironment(s3=fakes.fakeS3(latency=args.s3_latency),
+                                 data_api=fakes.fakeDataAPI(latency=args.data_api_latency),
+                                 routes={'cloud.getdbt.com': stub, 'metadata.cloud.getdbt.com': stub},
+                                 verbose=args.verbose)
+
+    recorder = stageRecorder('dbt_monitoring', env, stubs=[stub], track_memory=not args.skip_memory)
+    try:
+        with env.active(), working_directory():
+            dbt_monitoring = env.import_module('dbt_monitoring')
+            audits = dbt_monitoring.dbtAudits(DBT_CONFIG)
+            recorder.stage('fetch_run_list', lambda: audits.fetch_run_list(limit=10, job_id=DBT_CONFIG['dbt_production_job_id'], scheduled_only=True),
+                           items=min(scale['runs'], 10), unit='runs')
+            recorder.stage('load_run_details', lambda: audits.load_run_details(target_table='run_details'), items=scale['models'], unit='models')
+            recorder.stage('load_tests', lambda: audits.load_tests(target_table='tests'), items=scale['tests'], unit='tests')
+    finally:
+        stub.stop()
+    return recorder.results
+
+def bench_mixpanel(scale, args):
+    stub = fakes.mixpanelStub(latency=args.http_latency).start()
+    env = fakes.localEnvironment(s3=fakes.fakeS3(latency=args.s3_latency),
+                                 data_api=fakes.fakeDataAPI(latency=args.data_api_latency),
+                                 routes={'api.mixpanel.com': stub},
+                                 verbose=args.verbose)
+    n_upserts = generators.seed_user_snapshots(env.s3, MIXPANEL_S3['bucket'], MIXPANEL_S3['prefix'], MIXPANEL_S3['identifier'],
+                                               n_users=scale['users'], seed=args.seed)
+
+    # the module is a script, so it runs as a single stage
+    recorder = stageRecorder('mixpanel_user_properties', env, stubs=[stub], track_memory=not args.skip_memory)
+    try:
+        with env.active(), working_directory():
+            recorder.stage('script', lambda: runpy.run_path(os.path.join(ETL_DIR, 'mixpanel_user_properties.py'), run_name='__main__'),
+                           items=n_upserts, unit='profiles')
+    finally:
+        stub.stop()
+    if not recorder.failed and stub.profiles != n_upserts:
+        print(f'[WARN] mixpanel_user_properties: expected {n_upserts} profile update(s), stub received {stub.profiles}.', file=sys.stderr)
+    return recorder.results
+
+BENCHMARKS = {'tealium': bench_tealium, 'tealium_continuous': bench_tealium_continuous, 'tealium_sharded': bench_tealium_sharded, 'dbt': bench_dbt, 'mixpanel': bench_mixpanel}
+
+def aggregate(repeats):
+    '''
+    Combines the results of repeated runs: median wall time and throughput, maximum peak memory.
+    '''
+    combined = []
+    for stage_results in zip(*repeats):
+        result = dict(stage_results[0])
+        timed = [r for r in stage_results if r.get('seconds') is not None]
+        if timed:
+            result['seconds'] = statistics.median(r['seconds'] for r in timed)
+            result['throughput'] = result['items'] / result['seconds'] if result['items'] and result['seconds'] else None
+            memory = [r['peak_mb'] for r in timed if r['peak_mb'] is not None]
+            result['peak_mb'] = max(memory) if memory else None
+            for key in ['latency_p50', 'latency_p95', 'latency_max']:
+                if all(key in r for r in timed):
+                    result[key] = statistics.median(r[key] for r in timed)
+            for key in ['lost', 'duplicated', 'skipped', 'unfinished', 'not_loaded']:
+                if all(key in r for r in timed):
+                    result[key] = max(r[key] for r in timed)
+        result['errors'] = max(r.get('errors', 0) for r in stage_results)
+        result['repeats'] = len(timed)
+        combined.append(result)
+    return combined
+
+def compare(results, baseline, threshold):
+    '''
+    Returns (pipeline, stage, metric, old, new, change) for every stage whose throughput fell, or whose peak memory grew, by more than threshold.
+    '''
+    previous = {(r['pipeline'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = previous.get((r['pipeline'], r['stage']))
+        if old is None:
+            continue
+        if old.get('throughput') and r.get('throughput'):
+            change = r['throughput'] / old['throughput'] - 1
+            if change < -threshold:
+                regressions.append((r['pipeline'], r['stage'], 'throughput', old['throughput'], r['throughput'], change))
+        if old.get('peak_mb') and r.get('peak_mb'):
+            change = r['peak_mb'] / old['peak_mb'] - 1
+            if change > threshold:
+                regressions.append((r['pipeline'], r['stage'], 'peak_mb', old['peak_mb'], r['peak_mb'], change))
+    return regressions
+
+def format_number(value, spec):
+    return '-' if value is None else format(value, spec)
+
+def print_report(results):
+    header = f"{'pipeline':<26}{'stage':<24}{'seconds':>10}{'items':>10}{'throughput':>20}{'peak MB':>10}{'stmts':>7}{'S3':>6}{'HTTP':>6}{'errors':>8}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        throughput = '-' if r.get('throughput') is None else f"{r['throughput']:,.1f} {r['unit']}/s"
+        print(f"{r['pipeline']:<26}{r['stage']:<24}{format_number(r.get('seconds'), '.3f'):>10}{r['items']:>10,}{throughput:>20}"
+              f"{format_number(r.get('peak_mb'), '.1f'):>10}{r.get('statements', 0):>7}{r.get('s3_calls', 0):>6}"
+              f"{r.get('http_requests', 0):>6}{r.get('errors', 0) + ('exception' in r):>8}")
+    for r in results:
+        if 'latency_p50' in r:
+            print(f"{r['pipeline']}.{r['stage']} arrival-to-load latency: p50 {r['latency_p50']:.2f}s, "
+                  f"p95 {r['latency_p95']:.2f}s, max {r['latency_max']:.2f}s")
+        if r.get('not_loaded'):
+            print(f"{r['pipeline']}.{r['stage']}: {r['not_loaded']} object(s) not loaded before the deadline")
+        if 'lost' in r:
+            print(f"{r['pipeline']}.{r['stage']}: {r['lost']} object(s) lost ({r.get('skipped', 0)} skipped after failing), "
+                  f"{r['duplicated']} loaded more than once, {r.get('unfinished', 0)} shard(s) unfinished")
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ETL_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ETL modules against local stand-ins for S3, the Redshift Data API, dbt Cloud and Mixpanel.')
+    parser.add_argument('--pipelines', nargs='+', choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for key in SCALES['small']: # override any single dimension of the chosen scale
+        parser.add_argument(f"--{key.replace('_', '-')}", type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=1, help='run each pipeline N times and report the median')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--s3-latency', type=float, default=0.0, help='seconds added to every S3 call')
+    parser.add_argument('--data-api-latency', type=float, default=0.0, help='seconds added to every Data API statement')
+    parser.add_argument('--http-latency', type=float, default=0.0, help='seconds added to every stub HTTP response')
+    parser.add_argument('--arrival-interval', type=float, default=0.05, help='seconds between new objects in the continuous benchmark')
+    parser.add_argument('--flush-rows', type=int, default=50000, help='row threshold passed to run_continuous()')
+    parser.add_argument('--flush-seconds', type=float, default=1.0, help='latency threshold passed to run_continuous()')
+    parser.add_argument('--workers', type=int, default=4, help='worker threads in the sharded benchmark')
+    parser.add_argument('--shards', type=int, default=16, help='shards in the sharded benchmark')
+    parser.add_argument('--shard-strategy', choices=['hash', 'hour'], default='hash')
+    parser.add_argument('--lease-store', choices=['sqlite', 'redshift'], default='sqlite',
+                        help="lease store for the sharded benchmark; 'redshift' runs its SQL against an in-memory SQLite database")
+    parser.add_argument('--skip-memory', action='store_true', help='disable tracemalloc (it slows down allocation-heavy stages)')
+    parser.add_argument('--label', default=None, help='version label stored with the results (default: git revision)')
+    parser.add_argument('--output', default=None, help='write results as JSON to this path')
+    parser.add_argument('--baseline', default=None, help='JSON results from a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change flagged as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help='echo all db3 log messages')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+
+    results = []
+    for name in args.pipelines:
+        results += aggregate([BENCHMARKS[name](scale, args) for _ in range(args.repeat)])
+
+    print_report(results)
+    report = {'label': args.label or git_revision(),
+              'created_at': datetime.now(timezone.utc).isoformat(),
+              'scale': scale,
+              'latency': {'s3': args.s3_latency, 'data_api': args.data_api_latency, 'http': args.http_latency},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = any('exception' in r for r in results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\nCompared with {baseline.get('label')}: {len(regressions)} regression(s) beyond {args.threshold:.0%}.")
+        for pipeline, stage, metric, old, new, change in regressions:
+            print(f'  {pipeline}.{stage} {metric}: {old:,.2f} -> {new:,.2f} ({change:+.1%})')
+        failed = failed or (args.fail_on_regression and bool(regressions))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
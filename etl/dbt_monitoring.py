@@ -67,7 +67,82 @@ class dbtAudits:
                 response_text_json = json.loads(response.text)
                 user_message = response_text_json['status']['user_message']
                 raise Exception(f'[ERROR] Status {response.status_code}: {user_message}')
-   
+
+    def call_metadata_api(self, query):
+        '''
+        Wrapper function to post a GraphQL query to the DBT Metadata API.
+
+        Parameters:
+            query (str):
+                The GraphQL query, e.g. the 'models' or 'tests' query for a specific job and run.
+
+        Returns:
+            response: a requests response object (only when the API call is successful)
+        '''
+        url = 'https://metadata.cloud.getdbt.com/graphql'
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f"Bearer {self.dbt_api_key}"
+        }
+
+        db3.log(type='info', message='Calling DBT Metadata API...')
+        try:
+            response = requests.post(url=url, headers=headers, json={'query': query})
+        except Exception as e:
+            raise Exception(f'[ERROR] {e}') from None # suppress exception chaining
+        else:
+            # GraphQL errors are returned in the body, sometimes with status=200
+            if response.status_code == 200 and not json.loads(response.text).get('errors'):
+                db3.log(type='info', message='DBT Metadata API call successful.')
+                return response
+            else:
+                raise Exception(f'[ERROR] Status {response.status_code}: {response.text}')
+
+    def fetch_run_list(self, limit=None, job_id=None, run_id=None, scheduled_only=False):
+        '''
+        Calls the "Runs" endpoint and flattens the response into a data frame (one row per run).
+
+        Parameters:
+            limit (int):
+                The number of runs to return (see call_cloud_api()).
+            job_id (int, optional):
+                If provided, will only return runs from that job.
+            run_id (int, optional):
+                If provided, will only return that run.
+            scheduled_only (bool, optional):
+                If true, drops manually triggered runs.
+
+        Returns:
+            df: data frame with columns run_id, job_id, href, trigger_cause, created_at, should_start_at, started_at, finished_at
+        '''
+        response = self.call_cloud_api(limit=limit, job_id=job_id, run_id=run_id)
+        runs = json.loads(response.text)['data']
+        if run_id: # single run is returned as a dict
+            runs = [runs]
+
+        df = pd.json_normalize(runs)
+        df.rename(columns = {'id': 'run_id',
+                             'job_definition_id': 'job_id',
+                             'trigger.cause': 'trigger_cause'},
+                  inplace=True)
+        df = df[['run_id', 'job_id', 'href', 'trigger_cause', 'created_at', 'should_start_at', 'started_at', 'finished_at']]
+
+        if scheduled_only:
+            df = df[df['trigger_cause'].str.startswith('Scheduled')].reset_index(drop=True)
+
+        db3.log(type='info', message=f'{len(df.index)} run(s) returned.')
+        return df
+
+    def get_most_recent_run(self, job_id):
+        '''
+        Returns a single-row data frame (see fetch_run_list()) for the most recent scheduled run of the given job.
+        '''
+        db3.log(type='info', message=f'Fetching most recent scheduled run of job {job_id}.')
+        run_list = self.fetch_run_list(limit=10, job_id=job_id, scheduled_only=True)
+        run = run_list[run_list['should_start_at'] == run_list['should_start_at'].max()].reset_index(drop=True)
+        db3.log(type='info', message=f"Using run ID {run['run_id'][0]}.")
+        return run
+
     def load_run_details(self, target_table, run_id=None):
         '''
         Fetch model-level metadata for a specific run, processes it, and loads it into the target table in Redshift.
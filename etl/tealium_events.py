@@ -6,9 +6,402 @@ import boto3
 import pandas as pd   
 pd.options.mode.chained_assignment = None  # default='warn'
 import json
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import gzip
 import re
+import os
+import time
+import queue
+import signal
+import threading
+import hashlib
+import sqlite3
+import socket
+import random
+from collections import OrderedDict
+from urllib.parse import unquote_plus
+
+def parse_s3_notification(body):
+    '''
+    Returns the (object key, last modified) pairs in an S3 event notification message body. Test events and
+    non-create events are ignored. Bodies wrapped in an SNS envelope are unwrapped first.
+    '''
+    message = json.loads(body)
+    if 'Message' in message and 'Records' not in message: # delivered via SNS
+        message = json.loads(message['Message'])
+    objects = []
+    for record in message.get('Records', []):
+        if not record.get('eventName', '').startswith('ObjectCreated'):
+            continue
+        key = unquote_plus(record['s3']['object']['key']) # keys are URL-encoded in notifications
+        objects.append((key, pd.Timestamp(record['eventTime'])))
+    return objects
+
+class sqsNotificationQueue:
+    '''
+    Reads S3 "object created" notifications for the Tealium bucket from an SQS queue.
+    Messages are only deleted once acked, i.e. after their objects have been loaded; anything else is redelivered by SQS.
+    Messages that cannot be parsed are logged and never acked; give the queue a redrive policy to move them aside.
+    '''
+    def __init__(self, queue_url, sqs_client):
+        self.queue_url = queue_url
+        self.sqs_client = sqs_client
+
+    def receive(self, max_messages=10, wait_seconds=20):
+        response = self.sqs_client.receive_message(QueueUrl=self.queue_url,
+                                                   MaxNumberOfMessages=min(max_messages, 10), # SQS limit
+                                                   WaitTimeSeconds=int(min(wait_seconds, 20))) # long polling; SQS limit
+        messages = []
+        for m in response.get('Messages', []):
+            try:
+                objects = parse_s3_notification(m['Body'])
+            except Exception as e: # left unacked, so it ends up in the dead-letter queue if one is configured
+                db3.log(type='error', message=f"Unreadable notification {m.get('MessageId')}: {m['Body'][:200]}", e=e)
+                continue
+            messages.append({'receipt': m['ReceiptHandle'], 'objects': objects})
+        return messages
+
+    def ack(self, receipts):
+        for i in range(0, len(receipts), 10): # batch delete is limited to 10 entries
+            entries = [{'Id': str(n), 'ReceiptHandle': r} for n, r in enumerate(receipts[i:i+10])]
+            self.sqs_client.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+
+class localNotificationQueue:
+    '''
+    In-process stand-in for sqsNotificationQueue, for testing. Producers call send() with an S3 notification body
+    (or notify() with an object key); unacked messages can be put back with requeue_unacked() to mimic SQS redelivery.
+    '''
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.next_receipt = 0
+
+    def send(self, body):
+        self.messages.put(body)
+
+    def notify(self, object_key, last_modified=None):
+        last_modified = last_modified or datetime.now(timezone.utc)
+        self.send(json.dumps({'Records': [{'eventName': 'ObjectCreated:Put',
+                                           'eventTime': last_modified.isoformat(),
+                                           's3': {'object': {'key': object_key}}}]}))
+
+    def receive(self, max_messages=10, wait_seconds=20):
+        messages = []
+        try:
+            body = self.messages.get(timeout=wait_seconds) if wait_seconds > 0 else self.messages.get_nowait()
+            while True:
+                with self.lock:
+                    receipt = str(self.next_receipt)
+                    self.next_receipt += 1
+                    self.in_flight[receipt] = body
+                try:
+                    messages.append({'receipt': receipt, 'objects': parse_s3_notification(body)})
+                except Exception as e: # stays in flight, like an unacked SQS message
+                    db3.log(type='error', message=f'Unreadable notification {receipt}: {body[:200]}', e=e)
+                if len(messages) >= max_messages:
+                    break
+                body = self.messages.get_nowait()
+        except queue.Empty:
+            pass
+        return messages
+
+    def ack(self, receipts):
+        with self.lock:
+            for receipt in receipts:
+                self.in_flight.pop(receipt, None)
+
+    def requeue_unacked(self):
+        with self.lock:
+            bodies, self.in_flight = list(self.in_flight.values()), {}
+        for body in bodies:
+            self.messages.put(body)
+
+class redshiftFailureStore:
+    '''
+    Table of objects that could not be extracted or loaded yet ('pending') or were given up on ('skipped'). The watermark
+    moves past such objects, so they are recorded here and retried from here by the next run.
+    '''
+    def __init__(self, schema, table='failed_objects'):
+        self.table = f'{schema}.{table}'
+
+    def __execute(self, query, fetch=False):
+        response = db3.execute_statement(query=query)
+        db3.validate_query(response_id=response['Id'])
+        if fetch:
+            records = db3.get_statement_result(response=response)['Records']
+            return [[None if field.get('isNull') else list(field.values())[0] for field in record] for record in records]
+
+    def ensure(self):
+        self.__execute(f'''
+                       create table if not exists {self.table}
+                       (object_key varchar(1024), last_modified varchar(64), status varchar(16), attempts integer, updated_at timestamp)
+                       ''')
+
+    def record(self, object_key, last_modified, status, attempts):
+        self.__execute(f'''
+                       begin transaction;
+                       delete from {self.table} where object_key = '{object_key}';
+                       insert into {self.table} values ('{object_key}', '{last_modified}', '{status}', {int(attempts)}, getdate());
+                       end transaction;
+                       ''')
+
+    def clear(self, object_key):
+        self.__execute(f"delete from {self.table} where object_key = '{object_key}'")
+
+    def list(self):
+        '''
+        Returns (object key, last modified, status) for every recorded object, in key order.
+        '''
+        rows = self.__execute(f'select object_key, last_modified, status from {self.table} order by object_key', fetch=True)
+        return [(object_key, pd.Timestamp(last_modified), status) for object_key, last_modified, status in rows]
+
+class sqliteFailureStore:
+    '''
+    Local stand-in for redshiftFailureStore, for testing.
+    '''
+    def __init__(self, path, table='failed_objects'):
+        self.table = table
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def __execute(self, query, parameters=()):
+        with self.lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def ensure(self):
+        self.__execute(f'''
+                       create table if not exists {self.table}
+                       (object_key text primary key, last_modified text, status text, attempts integer, updated_at real)
+                       ''')
+
+    def record(self, object_key, last_modified, status, attempts):
+        self.__execute(f'insert or replace into {self.table} values (?, ?, ?, ?, ?)', (object_key, str(last_modified), status, attempts, time.time()))
+
+    def clear(self, object_key):
+        self.__execute(f'delete from {self.table} where object_key = ?', (object_key,))
+
+    def list(self):
+        rows = self.__execute(f'select object_key, last_modified, status from {self.table} order by object_key')
+        return [(object_key, pd.Timestamp(last_modified), status) for object_key, last_modified, status in rows]
+
+HOUR_PATTERN = r'(\d{4})/?(\d{2})/?(\d{2})/?(\d{2})'
+
+def key_hour(object_key, hour_pattern=HOUR_PATTERN):
+    '''
+    Returns the hour (UTC) of the first YYYY/MM/DD/HH timestamp found in an object key (without the Tealium prefix).
+    '''
+    match = re.search(hour_pattern, object_key)
+    if match is None:
+        raise Exception(f'[ERROR] No hour found in object key: {object_key}')
+    return datetime(*[int(x) for x in match.groups()], tzinfo=timezone.utc)
+
+def hour_shard(hour, n_shards):
+    return int(hour.timestamp() // 3600) % n_shards
+
+def shard_for_key(object_key, n_shards, strategy='hash', hour_pattern=HOUR_PATTERN):
+    '''
+    Maps an object key (without the Tealium prefix) to a shard in [0, n_shards).
+    'hash' spreads keys evenly by MD5 (stable across processes, unlike hash()); 'hour' keeps each hour of the feed
+    together and deals consecutive hours out round-robin (see key_hour()).
+    '''
+    if strategy == 'hash':
+        return int(hashlib.md5(object_key.encode('utf8')).hexdigest(), 16) % n_shards
+    elif strategy == 'hour':
+        return hour_shard(key_hour(object_key, hour_pattern), n_shards)
+    else:
+        raise Exception(f'[ERROR] Unknown shard strategy: {strategy}')
+
+class redshiftLeaseStore:
+    '''
+    Coordination table for run_sharded(): one row per shard holding the current lease (worker ID and expiry) and the
+    shard's watermark. Claims and watermark updates are conditional updates followed by a read-back, since db3 does not
+    expose affected row counts; conflicting concurrent updates are aborted by Redshift's serializable isolation.
+    '''
+    def __init__(self, schema, table='shard_leases'):
+        self.table = f'{schema}.{table}'
+
+    def __execute(self, query, fetch=False):
+        response = db3.execute_statement(query=query)
+        db3.validate_query(response_id=response['Id'])
+        if fetch:
+            records = db3.get_statement_result(response=response)['Records']
+            return [[None if field.get('isNull') else list(field.values())[0] for field in record] for record in records]
+
+    def ensure_shards(self, n_shards, initial_watermark):
+        '''
+        Creates the table and adds any missing shard rows, starting at initial_watermark. Safe to re-run, but NOT safe to run
+        concurrently: Redshift does not enforce primary keys, so run it once before starting workers (see tealiumETL.setup_shards()).
+        Duplicate shard rows left behind by concurrent calls are collapsed into one, keeping the lowest watermark.
+        '''
+        self.__execute(f'''
+                       create table if not exists {self.table}
+                       (shard_id integer, n_shards integer, worker_id varchar(256), lease_expires_at timestamp, watermark varchar(1024), updated_at timestamp)
+                       ''')
+        existing = self.__execute(f'select distinct n_shards from {self.table}', fetch=True)
+        if any(row[0] != n_shards for row in existing):
+            raise Exception(f'[ERROR] {self.table} is set up for a different number of shards than {n_shards}.')
+
+        shards = ' union all '.join(f'select {shard_id} as shard_id' for shard_id in range(n_shards))
+        self.__execute(f'''
+                       insert into {self.table}
+                       select s.shard_id, {n_shards}, null, null, '{initial_watermark}', getdate()
+                       from ({shards}) s
+                       where not exists (select 1 from {self.table} l where l.shard_id = s.shard_id)
+                       ''')
+
+        duplicates = [row[0] for row in self.__execute(f'select shard_id from {self.table} group by shard_id having count(*) > 1', fetch=True)]
+        if duplicates:
+            db3.log(type='warn', message=f'Collapsing duplicate rows for shard(s) {duplicates} in {self.table}.')
+            ids = ', '.join(str(shard_id) for shard_id in duplicates)
+            self.__execute(f'''
+                           begin transaction;
+                           create temp table shard_dedupe as
+                           select shard_id, max(n_shards) as n_shards, min(watermark) as watermark from {self.table} where shard_id in ({ids}) group by shard_id;
+                           delete from {self.table} where shard_id in ({ids});
+                           insert into {self.table} select shard_id, n_shards, null, null, watermark, getdate() from shard_dedupe;
+                           drop table shard_dedupe;
+                           end transaction;
+                           ''')
+
+    def shard_count(self):
+        return self.__execute(f'select count(*) from {self.table}', fetch=True)[0][0]
+
+    def claim(self, worker_id, lease_seconds, exclude=(), released_before=None):
+        '''
+        Claims a random free shard that is not in exclude. A shard is free if its lease has expired, or if it is unleased and
+        (when released_before is given) was last released before then, so shards other workers drained in this run are not
+        listed again. Workers that lose a race for a shard back off briefly (with jitter) and try again; None is only
+        returned once no free, non-excluded shard is left.
+        '''
+        exclusion = f"and shard_id not in ({', '.join(str(x) for x in exclude)})" if exclude else ''
+        # getdate() has whole-second precision: shards seeded in the second the run started must stay claimable
+        released = f"and updated_at <= '{released_before.astimezone(timezone.utc):%Y-%m-%d %H:%M:%S}'" if released_before else ''
+        free_condition = f'((worker_id is null {released}) or lease_expires_at < getdate())'
+        attempt = 0
+        while True:
+            free = self.__execute(f'''
+                                  select shard_id from {self.table}
+                                  where {free_condition} {exclusion}
+                                  ''', fetch=True)
+            if not free:
+                return None
+            shard_id = random.choice(free)[0] # spread simultaneous claims over the free shards
+            try:
+                self.__execute(f'''
+                               update {self.table}
+                               set worker_id = '{worker_id}', lease_expires_at = dateadd(second, {int(lease_seconds)}, getdate()), updated_at = getdate()
+                               where shard_id = {shard_id} and {free_condition}
+                               ''')
+            except Exception as e: # aborted by serializable isolation; the read-back below decides
+                db3.log(type='warn', message=f'Claim of shard {shard_id} by {worker_id} was aborted.', e=e)
+            claimed = self.__execute(f'''
+                                     select shard_id from {self.table}
+                                     where shard_id = {shard_id} and worker_id = '{worker_id}' and lease_expires_at > getdate()
+                                     ''', fetch=True)
+            if claimed:
+                return shard_id
+            attempt += 1
+            time.sleep(random.uniform(0, min(0.5 * 2 ** attempt, 10)))
+
+    def release(self, shard_id, worker_id):
+        self.__execute(f"update {self.table} set worker_id = null, lease_expires_at = null, updated_at = getdate() where shard_id = {shard_id} and worker_id = '{worker_id}'")
+
+    def get_watermark(self, shard_id):
+        return self.__execute(f'select watermark from {self.table} where shard_id = {shard_id}', fetch=True)[0][0]
+
+    def set_watermark(self, shard_id, worker_id, watermark, lease_seconds):
+        '''
+        Advances the shard's watermark and renews the lease, only if worker_id still holds it. Returns whether it did.
+        '''
+        try:
+            self.__execute(f'''
+                           update {self.table}
+                           set watermark = '{watermark}', lease_expires_at = dateadd(second, {int(lease_seconds)}, getdate()), updated_at = getdate()
+                           where shard_id = {shard_id} and worker_id = '{worker_id}' and lease_expires_at > getdate()
+                           ''')
+        except Exception as e: # aborted by serializable isolation; the read-back below decides
+            db3.log(type='warn', message=f'Watermark update of shard {shard_id} by {worker_id} was aborted.', e=e)
+        # the new owner of an expired lease may have written the same watermark, so check the lease as well
+        updated = self.__execute(f'''
+                                 select shard_id from {self.table}
+                                 where shard_id = {shard_id} and worker_id = '{worker_id}' and watermark = '{watermark}' and lease_expires_at > getdate()
+                                 ''', fetch=True)
+        return bool(updated)
+
+class sqliteLeaseStore:
+    '''
+    Local stand-in for redshiftLeaseStore, for testing: the same coordination table in a SQLite file, which can be
+    shared by worker threads or processes on one machine.
+    '''
+    def __init__(self, path, table='shard_leases'):
+        self.table = table
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute(f'''
+                                create table if not exists {table}
+                                (shard_id integer primary key, n_shards integer, worker_id text, lease_expires_at real, watermark text, updated_at real)
+                                ''')
+
+    def __transaction(self, fn):
+        with self.lock:
+            self.connection.execute('begin immediate') # takes the write lock, so claims are atomic across processes
+            try:
+                result = fn(self.connection)
+            except Exception:
+                self.connection.execute('rollback')
+                raise
+            self.connection.execute('commit')
+            return result
+
+    def ensure_shards(self, n_shards, initial_watermark):
+        def ensure(c):
+            existing = {row[0] for row in c.execute(f'select distinct n_shards from {self.table}')}
+            if existing - {n_shards}:
+                raise Exception(f'[ERROR] {self.table} is set up for a different number of shards than {n_shards}.')
+            c.executemany(f'insert or ignore into {self.table} (shard_id, n_shards, watermark, updated_at) values (?, ?, ?, ?)',
+                          [(shard_id, n_shards, initial_watermark, time.time()) for shard_id in range(n_shards)])
+        self.__transaction(ensure)
+
+    def shard_count(self):
+        return self.__transaction(lambda c: c.execute(f'select count(*) from {self.table}').fetchone()[0])
+
+    def claim(self, worker_id, lease_seconds, exclude=(), released_before=None):
+        released_before = released_before.timestamp() if released_before else float('inf')
+        def claim(c):
+            now = time.time()
+            rows = c.execute(f'''
+                             select shard_id from {self.table}
+                             where (worker_id is null and updated_at < ?) or lease_expires_at < ?
+                             order by shard_id
+                             ''', (released_before, now))
+            candidates = [row[0] for row in rows if row[0] not in exclude]
+            if not candidates:
+                return None
+            c.execute(f'update {self.table} set worker_id = ?, lease_expires_at = ?, updated_at = ? where shard_id = ?',
+                      (worker_id, now + lease_seconds, now, candidates[0]))
+            return candidates[0]
+        return self.__transaction(claim)
+
+    def release(self, shard_id, worker_id):
+        self.__transaction(lambda c: c.execute(f'update {self.table} set worker_id = null, lease_expires_at = null, updated_at = ? where shard_id = ? and worker_id = ?',
+                                               (time.time(), shard_id, worker_id)))
+
+    def get_watermark(self, shard_id):
+        return self.__transaction(lambda c: c.execute(f'select watermark from {self.table} where shard_id = ?', (shard_id,)).fetchone()[0])
+
+    def set_watermark(self, shard_id, worker_id, watermark, lease_seconds):
+        '''
+        Advances the shard's watermark and renews the lease, only if worker_id still holds it. Returns whether it did.
+        '''
+        def update(c):
+            now = time.time()
+            cursor = c.execute(f'''
+                               update {self.table} set watermark = ?, lease_expires_at = ?, updated_at = ?
+                               where shard_id = ? and worker_id = ? and lease_expires_at > ?
+                               ''', (watermark, now + lease_seconds, now, shard_id, worker_id, now))
+            return cursor.rowcount == 1
+        return self.__transaction(update)
 
 class tealiumETL:
     def __init__(self, config): 
@@ -17,6 +410,7 @@ class tealiumETL:
 
         self.tealium_s3_client = self.__tealiumS3Client()
         self.tealium_s3_resource = self.__tealiumS3Resource()
+        self.stop_event = threading.Event() # set by stop() to end run_continuous()
 
     def __tealiumS3Client(self):
         return boto3.client(service_name='s3',
@@ -82,59 +476,73 @@ class tealiumETL:
         object_list['colnames'] = None
 
         for index, row in object_list.iterrows():
-            object_key = row['object_key']
-            object_key_destination_name = re.sub(self.tealium_prefix, '', object_key) # strip prefix from filename; contains '/' and is treated as filepath
-            
-            # extract objects
-            db3.log(type='info', message=f'Extracting file {index+1} of {len(object_list.index)}: {object_key}')
-            try:
-                self.tealium_s3_resource.Bucket(self.tealium_bucket_name).download_file(object_key, object_key_destination_name)
-            except Exception as e:
-                db3.log(type='error', message=f'Error extracting file {index+1} of {len(object_list.index)}: {object_key}', e=e)
-            
-            # clean objects
-            db3.log(type='info', message=f'Cleaning file {index+1} of {len(object_list.index)}.')
-            try:
-                # conversion process here is bytes > strings > dicts > data frame
-                # for strings, it's one list where each element is a stringified json dict
-                with gzip.open(object_key_destination_name, 'rb') as f:
-                    bytes = f.read()
-        
-                # convert bytes to strings (creates a list of strings)
-                strings = bytes.decode('utf8').split('\n')
-                strings = json.loads(json.dumps(strings)) 
-
-                # convert each string to dict, append to new list
-                dicts = []
-                for row in strings: 
-                    dicts.append(json.loads(row))
-        
-                # convert to dataframe, subset, rename
-                df = pd.DataFrame(dicts) # convert list of dicts to dataframe 
-                df_clean = df[df.columns.intersection(self.keep_cols)] # subset to only cols that are in keep list
-                df_clean.rename(columns = self.rename_dict, inplace=True)
-        
-                # per Tealium docs, 'eventtime' is stored as UNIX/epoch timestamp (but is also x1000 for some reason...)
-                df_clean['event_time'] = df_clean['event_time'].apply(lambda x: datetime.fromtimestamp(x/1000).astimezone(tz=timezone.utc))
+            extracted = self.extract_object(row['object_key'], label=f'{index+1} of {len(object_list.index)}')
+            if extracted is not None:
+                object_list.iloc[index, 2] = extracted[0] # add colnames tuple to object list
 
-                # store column names as tuple for COPY command.
-                colnames = tuple(df_clean.columns.values.tolist())
-                colnames = str(colnames).replace('\'', '') # strip single quotes around names
-                object_list.iloc[index, 2] = colnames # add colnames tuple to object list
-            except Exception as e:
-                db3.log(type='error', message=f'Error cleaning file {index+1} of {len(object_list.index)}: {object_key}', e=e)         
+    def extract_object(self, object_key, label=''):
+        '''
+        Extract a single event feed object, clean it, and write it to S3 as CSV for the COPY command.
+        Returns a (colnames, number of rows) tuple, or None if any step failed (errors are logged, not raised).
+        '''
+        object_key_destination_name = re.sub(self.tealium_prefix, '', object_key) # strip prefix from filename; contains '/' and is treated as filepath
 
-            # write file to S3.
-            db3.log(type='info', message=f'Loading to S3 file {index+1} of {len(object_list.index)}.')
-            try:
-                filename = self.bucket_prefix + re.sub('(.gz$)', '.csv', object_key_destination_name) # swap in correct extension 
-                db3.s3_resource.Object(self.bucket_name, filename).put(Body=df_clean.to_csv(index=False, header=True))
-            except Exception as e:
-                db3.log(type='error', message=f'Error loading to S3 file {index+1} of {len(object_list.index)}: {object_key}', e=e) # suppress exception chaining
-    
-    def load_objects(self, object_list, split_temp_tables=False):
+        # extract objects
+        db3.log(type='info', message=f'Extracting file {label}: {object_key}')
+        try:
+            self.tealium_s3_resource.Bucket(self.tealium_bucket_name).download_file(object_key, object_key_destination_name)
+        except Exception as e:
+            db3.log(type='error', message=f'Error extracting file {label}: {object_key}', e=e)
+            return None
+
+        # clean objects
+        db3.log(type='info', message=f'Cleaning file {label}.')
+        try:
+            # conversion process here is bytes > strings > dicts > data frame
+            # for strings, it's one list where each element is a stringified json dict
+            with gzip.open(object_key_destination_name, 'rb') as f:
+                bytes = f.read()
+            os.remove(object_key_destination_name) # long-running jobs would otherwise fill the disk
+
+            # convert bytes to strings (creates a list of strings)
+            strings = bytes.decode('utf8').split('\n')
+            strings = json.loads(json.dumps(strings))
+
+            # convert each string to dict, append to new list
+            dicts = []
+            for row in strings:
+                dicts.append(json.loads(row))
+
+            # convert to dataframe, subset, rename
+            df = pd.DataFrame(dicts) # convert list of dicts to dataframe
+            df_clean = df[df.columns.intersection(self.keep_cols)] # subset to only cols that are in keep list
+            df_clean.rename(columns = self.rename_dict, inplace=True)
+
+            # per Tealium docs, 'eventtime' is stored as UNIX/epoch timestamp (but is also x1000 for some reason...)
+            df_clean['event_time'] = df_clean['event_time'].apply(lambda x: datetime.fromtimestamp(x/1000).astimezone(tz=timezone.utc))
+
+            # store column names as tuple for COPY command.
+            colnames = tuple(df_clean.columns.values.tolist())
+            colnames = str(colnames).replace('\'', '') # strip single quotes around names
+        except Exception as e:
+            db3.log(type='error', message=f'Error cleaning file {label}: {object_key}', e=e)
+            return None
+
+        # write file to S3.
+        db3.log(type='info', message=f'Loading to S3 file {label}.')
+        try:
+            filename = self.bucket_prefix + re.sub('(.gz$)', '.csv', object_key_destination_name) # swap in correct extension
+            db3.s3_resource.Object(self.bucket_name, filename).put(Body=df_clean.to_csv(index=False, header=True))
+        except Exception as e:
+            db3.log(type='error', message=f'Error loading to S3 file {label}: {object_key}', e=e) # suppress exception chaining
+            return None
+
+        return colnames, len(df_clean.index)
+
+    def load_objects(self, object_list, split_temp_tables=False, temp_suffix=''):
         '''
         Copies objects from S3 bucket into the target table in Redshift cluster.
+        temp_suffix is appended to the temp table name, so that concurrent workers (see run_sharded()) do not share one.
         '''
         # for QA: option to create indexed temp tables
         if split_temp_tables:
@@ -154,7 +562,7 @@ class tealiumETL:
 
             # create temp table
             create_temp_table_query = f'''
-                                       create table if not exists {self.target_schema}.{self.target_table}_temp{i}
+                                       create table if not exists {self.target_schema}.{self.target_table}_temp{temp_suffix}{i}
                                        (like {self.target_schema}.{self.target_table})
                                        '''
             create_temp_table_response = db3.execute_statement(query=create_temp_table_query)
@@ -162,7 +570,7 @@ class tealiumETL:
 
             # copy contents to temp table
             load_query = f'''
-                        copy {self.target_schema}.{self.target_table}_temp{i} {colnames}
+                        copy {self.target_schema}.{self.target_table}_temp{temp_suffix}{i} {colnames}
                         from 's3://{self.bucket_name}/{self.bucket_prefix}{object_key}'
                         credentials '{self.iam_role}'
                         ignoreheader 1
@@ -174,8 +582,8 @@ class tealiumETL:
             # delete any duped records in target table
             delete_dupes_query = f'''
                                   delete from {self.target_schema}.{self.target_table}
-                                  using {self.target_schema}.{self.target_table}_temp{i}
-                                  where {self.target_schema}.{self.target_table}.event_id = {self.target_schema}.{self.target_table}_temp{i}.event_id
+                                  using {self.target_schema}.{self.target_table}_temp{temp_suffix}{i}
+                                  where {self.target_schema}.{self.target_table}.event_id = {self.target_schema}.{self.target_table}_temp{temp_suffix}{i}.event_id
                                   '''
             delete_dupes_response = db3.execute_statement(query=delete_dupes_query)
             db3.validate_query(response_id=delete_dupes_response['Id'])
@@ -183,13 +591,13 @@ class tealiumETL:
             # insert records into target table. Colnames were included in COPY command and are not needed again here
             insert_query = f'''
                             insert into {self.target_schema}.{self.target_table}
-                            (select * from {self.target_schema}.{self.target_table}_temp{i})
+                            (select * from {self.target_schema}.{self.target_table}_temp{temp_suffix}{i})
                             '''
             insert_response = db3.execute_statement(query=insert_query)
             db3.validate_query(response_id=insert_response['Id'])
 
             # drop temp table
-            drop_temp_table_query = f'drop table {self.target_schema}.{self.target_table}_temp{i}'
+            drop_temp_table_query = f'drop table {self.target_schema}.{self.target_table}_temp{temp_suffix}{i}'
             drop_temp_table_response = db3.execute_statement(query=drop_temp_table_query)
             db3.validate_query(response_id=drop_temp_table_response['Id'])
 
@@ -205,3 +613,432 @@ class tealiumETL:
 
             if split_temp_tables: # if splitting, increment index
                 i+=1
+
+    def stop(self, *args):
+        '''
+        Requests a graceful shutdown of run_continuous(): buffered objects are flushed to Redshift before it returns.
+        Installed as the SIGTERM/SIGINT handler while run_continuous() is running on the main thread.
+        '''
+        db3.log(type='warn', message='Shutdown requested. Flushing buffered objects before exiting.')
+        self.stop_event.set()
+
+    def run_continuous(self, notifications=None, flush_rows=100000, flush_seconds=120, poll_seconds=20,
+                       list_interval_seconds=300, max_runtime_seconds=None, max_attempts=5, retry_backoff_seconds=30, failure_store=None):
+        '''
+        Long-running micro-batch mode. Objects are extracted as soon as they are discovered and buffered; the buffer is
+        upserted with load_objects() once it holds flush_rows rows or its oldest object has waited flush_seconds.
+        Objects are discovered through S3 "object created" notifications when a queue is provided, with periodic listing
+        after the watermark as a fallback (and as the only source when no queue is provided). The S3 clients created in
+        __init__ are reused for the life of the process.
+        Objects that fail to extract are retried with backoff and recorded in the failure store, so they are not lost when
+        the watermark moves past them: the store is read at startup and its objects are retried before anything else.
+
+        Parameters:
+            notifications (sqsNotificationQueue or localNotificationQueue, optional):
+                Source of new-object notifications. Messages are acked only after their objects have been loaded.
+            flush_rows (int):
+                Row-count threshold for flushing the buffer to Redshift.
+            flush_seconds (int):
+                Latency threshold: maximum time an extracted object waits in the buffer before it is loaded.
+            poll_seconds (int):
+                Long-poll wait for notifications, or the listing interval when no queue is provided.
+            list_interval_seconds (int):
+                Interval between fallback listings when a queue is provided.
+            max_runtime_seconds (int, optional):
+                If provided, exit (after flushing) once the job has run this long, e.g. to fit a scheduled window.
+            max_attempts (int):
+                Extraction attempts per object in this run before it is logged as an error and skipped.
+            retry_backoff_seconds (int):
+                Wait before retrying a failed object or flush; doubles with every failed attempt.
+            failure_store (redshiftFailureStore or sqliteFailureStore, optional):
+                Where pending and skipped objects are recorded. Defaults to the '<object_list_table>_failed' table.
+
+        Returns:
+            dict: number of objects and rows loaded, number of flushes, keys of skipped objects, and keys of objects
+            still pending (recorded in the failure store) when the job stopped
+        '''
+        db3.log(type='info', message='Starting continuous ingestion.')
+        self.stop_event.clear()
+        failure_store = failure_store or redshiftFailureStore(self.object_list_schema, f'{self.object_list_table}_failed')
+        failure_store.ensure()
+
+        listed_after = self.get_last_object() # listing watermark; objects it moves past while failing are in the failure store
+        seen = OrderedDict() # key > 'buffered', 'loaded' or 'skipped' for keys handled in this session, to drop duplicate notifications
+        failures = {} # key > failed attempts, retry time and last modified, for objects that are backing off
+        retry = {'failures': failures, 'max_attempts': max_attempts, 'backoff_seconds': retry_backoff_seconds,
+                 'store': failure_store, 'recorded': set()}
+        for object_key, last_modified, _ in failure_store.list(): # left over from earlier runs; retried right away
+            failures[object_key] = {'attempts': 0, 'retry_at': 0, 'last_modified': last_modified}
+            retry['recorded'].add(object_key)
+        if failures:
+            db3.log(type='info', message=f'Retrying {len(failures)} object(s) from the failure store.')
+
+        batch = {'objects': [], 'rows': 0, 'opened': None, 'receipts': [], 'failed_flushes': 0, 'retry_at': 0}
+        totals = {'objects': 0, 'rows': 0, 'flushes': 0, 'skipped': [], 'pending': []}
+        started = time.monotonic()
+        next_listing = started # list immediately to catch up on anything that arrived while the job was down
+        list_every = list_interval_seconds if notifications is not None else poll_seconds
+
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for sig in [signal.SIGTERM, signal.SIGINT]:
+                handlers[sig] = signal.signal(sig, self.stop)
+        try:
+            while not self.stop_event.is_set():
+                if max_runtime_seconds is not None and time.monotonic() - started >= max_runtime_seconds:
+                    db3.log(type='info', message=f'Reached max runtime of {max_runtime_seconds} seconds.')
+                    break
+
+                # wait for notifications (or for the next listing), but never past the buffer's flush deadline or a due retry
+                wait = max(next_listing - time.monotonic(), 0) if notifications is None else poll_seconds
+                if batch['opened'] is not None:
+                    wait = min(wait, max(max(batch['opened'] + flush_seconds, batch['retry_at']) - time.monotonic(), 0))
+                if failures:
+                    wait = min(wait, max(min(f['retry_at'] for f in failures.values()) - time.monotonic(), 0))
+
+                if notifications is not None:
+                    try:
+                        messages = notifications.receive(wait_seconds=wait)
+                    except Exception as e:
+                        db3.log(type='error', message='Error receiving notifications; relying on listing.', e=e)
+                        messages = []
+                        self.stop_event.wait(wait)
+                    for message in messages:
+                        in_buffer, pending = self.__buffer_objects(message['objects'], seen, batch, retry, totals)
+                        if pending: # leave unacked so the message is redelivered
+                            continue
+                        if in_buffer: # ack once the buffer has been loaded
+                            batch['receipts'].append(message['receipt'])
+                        else: # everything already loaded or skipped, or foreign prefix
+                            notifications.ack([message['receipt']])
+                elif wait > 0:
+                    self.stop_event.wait(wait)
+
+                if time.monotonic() >= next_listing:
+                    object_list = self.list_unloaded_objects(listed_after)
+                    if object_list is not None:
+                        for _, row in object_list.sort_values('object_key').iterrows():
+                            self.__buffer_objects([(row['object_key'], row['last_modified'])], seen, batch, retry, totals)
+                            listed_after = row['object_key']
+                    next_listing = time.monotonic() + list_every
+
+                due = [(object_key, f['last_modified']) for object_key, f in failures.items() if time.monotonic() >= f['retry_at']]
+                if due:
+                    self.__buffer_objects(due, seen, batch, retry, totals)
+
+                full = batch['rows'] >= flush_rows or (batch['opened'] is not None and time.monotonic() - batch['opened'] >= flush_seconds)
+                if full and time.monotonic() >= batch['retry_at']:
+                    self.__flush(batch, totals, notifications, seen, retry)
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+
+        if not self.__flush(batch, totals, notifications, seen, retry):
+            for row in batch['objects']: # their notifications stay unacked too, but listing would not find them again
+                failure_store.record(row['object_key'], row['last_modified'], 'pending', 0)
+                failures[row['object_key']] = {'attempts': 0, 'retry_at': 0, 'last_modified': row['last_modified']}
+        totals['pending'] = sorted(failures)
+        db3.log(type='warn' if totals['skipped'] or totals['pending'] else 'info',
+                message=f"Stopped continuous ingestion. Loaded {totals['objects']} object(s), {totals['rows']} row(s) in {totals['flushes']} flush(es); "
+                        f"skipped {len(totals['skipped'])} object(s); {len(totals['pending'])} object(s) pending in the failure store.")
+        return totals
+
+    def __buffer_objects(self, objects, seen, batch, retry, totals):
+        '''
+        Extracts any objects not already seen and adds them to the micro-batch. Returns whether any of the objects are in
+        the buffer (newly or from earlier) and whether any are pending, i.e. failed or backing off but not yet skipped.
+        '''
+        in_buffer, pending = False, False
+        for object_key, last_modified in objects:
+            if not object_key.startswith(self.tealium_prefix):
+                continue
+            if object_key in seen:
+                in_buffer = in_buffer or seen[object_key] == 'buffered'
+                continue
+            extracted, status = self.__extract_with_retries(object_key, last_modified, retry, label=f"{len(batch['objects'])+1} of micro-batch")
+            if status == 'pending':
+                pending = True
+                continue
+            seen[object_key] = 'buffered' if status == 'extracted' else 'skipped'
+            if len(seen) > 100000: # bounded; older keys are covered by the listing watermark
+                seen.popitem(last=False)
+            if status == 'skipped':
+                totals['skipped'].append(object_key)
+                continue
+            colnames, n_rows = extracted
+            batch['objects'].append({'object_key': object_key, 'last_modified': last_modified, 'colnames': colnames, 'rows': n_rows})
+            batch['rows'] += n_rows
+            if batch['opened'] is None:
+                batch['opened'] = time.monotonic()
+            in_buffer = True
+        return in_buffer, pending
+
+    def __extract_with_retries(self, object_key, last_modified, retry, label=''):
+        '''
+        Calls extract_object() unless the object is still backing off from an earlier failure. Failures are counted per key
+        in retry['failures'] and recorded in retry['store'] (if any) as 'pending'; after retry['max_attempts'] the object is
+        logged as an error and recorded as 'skipped'. Recorded objects are cleared from the store by __clear_failure() once loaded.
+        Returns (extracted, status), where status is 'extracted', 'pending' (try again later) or 'skipped'.
+        '''
+        failure = retry['failures'].get(object_key)
+        if failure is not None and time.monotonic() < failure['retry_at']:
+            return None, 'pending'
+
+        extracted = self.extract_object(object_key, label=label)
+        if extracted is not None:
+            retry['failures'].pop(object_key, None)
+            return extracted, 'extracted'
+
+        attempts = (failure['attempts'] if failure else 0) + 1
+        if attempts >= retry['max_attempts']:
+            retry['failures'].pop(object_key, None)
+            db3.log(type='error', message=f'Skipping {object_key} after {attempts} failed attempt(s).')
+            self.__record_failure(object_key, last_modified, 'skipped', attempts, retry)
+            return None, 'skipped'
+        delay = min(retry['backoff_seconds'] * 2 ** (attempts - 1), 900)
+        retry['failures'][object_key] = {'attempts': attempts, 'retry_at': time.monotonic() + delay, 'last_modified': last_modified}
+        db3.log(type='warn', message=f'Attempt {attempts} of {retry["max_attempts"]} failed for {object_key}. Retrying in {delay:.0f} seconds.')
+        self.__record_failure(object_key, last_modified, 'pending', attempts, retry)
+        return None, 'pending'
+
+    def __record_failure(self, object_key, last_modified, status, attempts, retry):
+        if retry.get('store') is not None:
+            retry['store'].record(object_key, last_modified, status, attempts)
+            retry['recorded'].add(object_key)
+
+    def __clear_failure(self, object_key, retry):
+        if object_key in retry.get('recorded', ()):
+            retry['store'].clear(object_key)
+            retry['recorded'].discard(object_key)
+
+    def __flush(self, batch, totals, notifications, seen, retry):
+        '''
+        Upserts the buffered objects one at a time, acks their notifications and resets the micro-batch. If a load fails,
+        the objects not loaded yet stay buffered with their notifications unacked, and the flush is retried after a backoff.
+        Returns whether the buffer was emptied.
+        '''
+        if not batch['objects']:
+            return True
+        waited = time.monotonic() - batch['opened']
+        db3.log(type='info', message=f"Flushing {len(batch['objects'])} object(s), {batch['rows']} row(s); oldest buffered for {waited:.1f} seconds.")
+        while batch['objects']:
+            row = batch['objects'][0]
+            try:
+                self.load_objects(pd.DataFrame([row], columns=['object_key', 'last_modified', 'colnames']))
+            except Exception as e:
+                batch['failed_flushes'] += 1
+                delay = min(retry['backoff_seconds'] * 2 ** (batch['failed_flushes'] - 1), 900)
+                batch['retry_at'] = time.monotonic() + delay
+                db3.log(type='error', message=f"Error loading {row['object_key']}; keeping {len(batch['objects'])} object(s) buffered, retrying in {delay:.0f} seconds.", e=e)
+                return False
+            batch['objects'].pop(0)
+            batch['rows'] -= row['rows']
+            if row['object_key'] in seen:
+                seen[row['object_key']] = 'loaded'
+            self.__clear_failure(row['object_key'], retry)
+            totals['objects'] += 1
+            totals['rows'] += row['rows']
+
+        if notifications is not None and batch['receipts']:
+            notifications.ack(batch['receipts'])
+        totals['flushes'] += 1
+        batch.update({'objects': [], 'rows': 0, 'opened': None, 'receipts': [], 'failed_flushes': 0, 'retry_at': 0})
+        return True
+
+    def setup_shards(self, lease_store, n_shards, failure_store=None):
+        '''
+        Creates the lease store's shard rows, each starting at the watermark from get_last_object(), and the failure store.
+        Run once before starting the workers of run_sharded(); it is not safe to run concurrently.
+        '''
+        db3.log(type='info', message=f'Setting up {n_shards} shard(s).')
+        lease_store.ensure_shards(n_shards, initial_watermark=self.get_last_object())
+        (failure_store or self.__default_failure_store()).ensure()
+
+    def __default_failure_store(self):
+        return redshiftFailureStore(self.object_list_schema, f'{self.object_list_table}_failed')
+
+    def run_sharded(self, lease_store, n_shards, worker_id=None, strategy='hash', lease_seconds=300, max_attempts=3,
+                    retry_backoff_seconds=5, hour_pattern=HOUR_PATTERN, hour_prefix_format='%Y%m%d%H', failure_store=None):
+        '''
+        Sharded mode, for running several workers at once (e.g. during replays). Object keys are partitioned into n_shards
+        with shard_for_key(); each worker claims one shard at a time through the lease store, loads that shard's objects
+        after the shard's own watermark, then releases it and claims the next, until no unclaimed shard is left. Use at
+        least as many shards as workers, and call setup_shards() once before starting them. The watermark is advanced (and
+        the lease renewed) after every object, so if a worker dies at most one object is loaded again by the next owner,
+        and load_objects() upserts on event_id.
+        Objects that keep failing are recorded in the failure store before the watermark moves past them, and each shard
+        retries its recorded objects the next time it is drained.
+        With 'hash' sharding every shard lists all keys after its watermark and discards other shards' keys, so S3 list
+        calls grow with the number of shards; 'hour' sharding only lists the shard's own hour prefixes. Keys without an
+        hour are recorded as 'no_hour' in the failure store (once, by their hash shard) and are not loaded.
+        Note: get_last_object() only gives a safe single-writer watermark once every shard has been drained.
+
+        Parameters:
+            lease_store (redshiftLeaseStore or sqliteLeaseStore):
+                The coordination table shared by all workers, set up with setup_shards().
+            n_shards (int):
+                Number of shards; must match the lease store.
+            worker_id (str, optional):
+                Identifies this worker in the lease store. Defaults to host, process and thread.
+            strategy (str):
+                'hash' or 'hour' (see shard_for_key()).
+            lease_seconds (int):
+                How long a lease lasts without progress before another worker can take the shard over.
+            max_attempts (int):
+                Extraction attempts per object before it is logged as an error, recorded as skipped and reported.
+            retry_backoff_seconds (int):
+                Wait before retrying a failed object; doubles with every failed attempt. Keep the total well under lease_seconds.
+            hour_pattern (str):
+                Regex for the hour in an object key, for 'hour' sharding (see key_hour()).
+            hour_prefix_format (str):
+                strftime format of the hour prefix that follows the Tealium prefix in object keys, for 'hour' sharding.
+            failure_store (redshiftFailureStore or sqliteFailureStore, optional):
+                Where skipped objects are recorded, shared by all workers. Defaults to the '<object_list_table>_failed' table.
+
+        Returns:
+            dict: number of objects loaded and shards processed by this worker, keys of skipped objects (including keys
+            without an hour), and shards left unfinished because the lease was lost
+        '''
+        worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}'
+        if lease_store.shard_count() != n_shards:
+            raise Exception(f'[ERROR] Lease store does not have exactly {n_shards} shard(s); run setup_shards() first.')
+        retry = {'failures': {}, 'max_attempts': max_attempts, 'backoff_seconds': retry_backoff_seconds,
+                 'store': failure_store or self.__default_failure_store(), 'recorded': set()}
+        hours = {'pattern': hour_pattern, 'prefix_format': hour_prefix_format}
+        processed = set() # shards this worker has already drained (or lost) in this run
+        started = datetime.now(timezone.utc) # shards released after this were drained by other workers in this run
+        totals = {'objects': 0, 'shards': 0, 'skipped': [], 'unfinished': []}
+
+        while True:
+            shard_id = lease_store.claim(worker_id, lease_seconds, exclude=processed, released_before=started)
+            if shard_id is None:
+                break
+            db3.log(type='info', message=f'Worker {worker_id} claimed shard {shard_id} of {n_shards}.')
+            try:
+                drained = self.__drain_shard(shard_id, n_shards, strategy, lease_store, worker_id, lease_seconds, retry, hours)
+            finally:
+                lease_store.release(shard_id, worker_id)
+            processed.add(shard_id)
+            totals['shards'] += 1
+            totals['objects'] += drained['loaded']
+            totals['skipped'] += drained['skipped']
+            if not drained['finished']:
+                totals['unfinished'].append(shard_id)
+
+        db3.log(type='error' if totals['skipped'] or totals['unfinished'] else 'info',
+                message=f"Worker {worker_id} finished. Loaded {totals['objects']} object(s) from {totals['shards']} shard(s); "
+                        f"skipped {len(totals['skipped'])} object(s); left shard(s) {totals['unfinished']} unfinished.")
+        return totals
+
+    def __drain_shard(self, shard_id, n_shards, strategy, lease_store, worker_id, lease_seconds, retry, hours):
+        '''
+        Retries the shard's objects recorded in the failure store, then loads its objects after its watermark, in key order.
+        Failed extractions are retried with backoff and then recorded as skipped (see __extract_with_retries()), so one bad
+        object cannot hold back the rest of the shard. Stops early only if the lease has been lost.
+        Returns the number loaded, skipped keys and whether the shard finished.
+        '''
+        drained = {'loaded': 0, 'skipped': [], 'finished': True}
+        # per worker as well as per shard: after a lease expires, the old owner may still be using its temp table
+        temp_suffix = f"_shard{shard_id}_{hashlib.md5(worker_id.encode('utf8')).hexdigest()[:8]}"
+        watermark = lease_store.get_watermark(shard_id)
+
+        recorded = {}
+        for object_key, last_modified, status in retry['store'].list():
+            if object_key.startswith(self.tealium_prefix) and self.__owning_shard(object_key, n_shards, strategy, hours) == shard_id:
+                recorded[object_key] = (last_modified, status)
+                retry['recorded'].add(object_key)
+        retries = {object_key: last_modified for object_key, (last_modified, status) in recorded.items() if status != 'no_hour'}
+        if retries:
+            db3.log(type='info', message=f'Retrying {len(retries)} object(s) of shard {shard_id} from the failure store.')
+
+        def shard_objects():
+            yield from ((object_key, last_modified, True) for object_key, last_modified in retries.items())
+            yield from (item for item in self.__shard_objects(shard_id, n_shards, strategy, watermark, hours) if item[0] not in retries)
+
+        for object_key, last_modified, has_hour in shard_objects():
+            if not has_hour:
+                if object_key not in recorded: # reported once, not on every run
+                    db3.log(type='warn', message=f'No hour found in object key {object_key}; recording it as skipped.')
+                    self.__record_failure(object_key, last_modified, 'no_hour', 0, retry)
+                    recorded[object_key] = (last_modified, 'no_hour')
+                    drained['skipped'].append(object_key)
+                continue
+
+            while True:
+                extracted, status = self.__extract_with_retries(object_key, last_modified, retry, label=f'in shard {shard_id}')
+                if status != 'pending':
+                    break
+                time.sleep(max(retry['failures'][object_key]['retry_at'] - time.monotonic(), 0))
+
+            if status == 'skipped': # recorded in the failure store by __extract_with_retries(), so it is safe to move past
+                drained['skipped'].append(object_key)
+            else:
+                shard_list = pd.DataFrame([{'object_key': object_key, 'last_modified': last_modified, 'colnames': extracted[0]}])
+                self.load_objects(shard_list, temp_suffix=temp_suffix)
+
+            if object_key not in retries: # retried objects are behind the watermark; only renew the lease for them
+                watermark = object_key
+            if not lease_store.set_watermark(shard_id, worker_id, watermark, lease_seconds):
+                db3.log(type='warn', message=f'Worker {worker_id} lost its lease on shard {shard_id}. Stopping.')
+                drained['finished'] = False
+                return drained
+            if status == 'extracted':
+                self.__clear_failure(object_key, retry)
+                drained['loaded'] += 1
+        return drained
+
+    def __owning_shard(self, object_key, n_shards, strategy, hours):
+        # keys without an hour belong to their hash shard, whatever the strategy
+        if strategy == 'hour' and re.search(hours['pattern'], object_key[len(self.tealium_prefix):]) is None:
+            strategy = 'hash'
+        return shard_for_key(object_key[len(self.tealium_prefix):], n_shards, strategy, hours['pattern'])
+
+    def __shard_objects(self, shard_id, n_shards, strategy, start_after, hours):
+        '''
+        Yields (object key, last modified, whether the key has an hour) for the shard's objects after start_after, in key order.
+        For 'hour' sharding, a one-key listing finds the next hour that has any objects; if that hour is not the shard's,
+        the listing jumps ahead to the shard's next hour, otherwise that hour's prefix is listed in full. Keys without an
+        hour are stepped over, and yielded (flagged) only to the shard that owns them by hash.
+        '''
+        if strategy != 'hour':
+            after = start_after
+            while True:
+                page = self.__list_keys(self.tealium_prefix, after)
+                for object_key, last_modified in page:
+                    if shard_for_key(object_key[len(self.tealium_prefix):], n_shards, strategy) == shard_id:
+                        yield object_key, last_modified, True
+                if len(page) < 1000: # list_objects_v2 returns at most 1000 keys per call
+                    return
+                after = page[-1][0]
+
+        cursor = start_after
+        while True:
+            following = self.__list_keys(self.tealium_prefix, cursor, max_keys=1)
+            if not following:
+                return
+            object_key, last_modified = following[0]
+            if re.search(hours['pattern'], object_key[len(self.tealium_prefix):]) is None:
+                if self.__owning_shard(object_key, n_shards, strategy, hours) == shard_id:
+                    yield object_key, last_modified, False
+                cursor = object_key
+                continue
+            hour = key_hour(object_key[len(self.tealium_prefix):], hours['pattern'])
+            if not object_key.startswith(self.tealium_prefix + hour.strftime(hours['prefix_format'])):
+                raise Exception(f"[ERROR] hour_prefix_format '{hours['prefix_format']}' does not match object key {object_key}")
+            hour += timedelta(hours=(shard_id - hour_shard(hour, n_shards)) % n_shards) # the shard's next hour
+            hour_prefix = self.tealium_prefix + hour.strftime(hours['prefix_format'])
+
+            after = max(start_after, hour_prefix)
+            while True:
+                page = self.__list_keys(hour_prefix, after)
+                for object_key, last_modified in page:
+                    yield object_key, last_modified, True
+                if len(page) < 1000:
+                    break
+                after = page[-1][0]
+            cursor = self.tealium_prefix + (hour + timedelta(hours=n_shards)).strftime(hours['prefix_format'])
+
+    def __list_keys(self, prefix, start_after, max_keys=1000):
+        response = self.tealium_s3_client.list_objects_v2(Bucket=self.tealium_bucket_name, Prefix=prefix,
+                                                          StartAfter=start_after, MaxKeys=max_keys)
+        return [(item['Key'], item['LastModified']) for item in response.get('Contents', [])]